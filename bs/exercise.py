@@ -14,6 +14,15 @@ logger = logging.getLogger(__name__)
 _l = logging.getLogger("ophyd")
 _l.setLevel(logging.WARN)
 
+# parameter IDs in the status packet (see v1/status_ids.json, v1/id_registry.py)
+CONTROLLER_NUMBER = 1028    # SetUpControllerNumber
+GAS_SET_POINT = 1050        # StatusGasSetPoint, centiK
+GAS_TEMP = 1051             # StatusGasTemp, centiK
+PHASE_ID = 1054             # StatusPhaseId
+ALARM_CODE = 1065           # StatusAlarmCode
+PARAMETERS = (CONTROLLER_NUMBER, GAS_SET_POINT, GAS_TEMP, PHASE_ID, ALARM_CODE)
+PACKET_SIZE = 928           # full status packet: 230 parameters
+
 
 class CS800(ophyd.Device):
     buffer = ophyd.Component(ophyd.EpicsSignal, ".BINP", kind="config")
@@ -33,6 +42,8 @@ class CS800(ophyd.Device):
 
     cksum = -1
     params = {}
+    layouts = {}    # tuple of the parameter IDs: {ID: offset of value}
+    offsets = {}    # of the current layout
 
     _phase_ids = [
         "Ramp",
@@ -52,37 +63,40 @@ class CS800(ophyd.Device):
     def listen(self, value=[], timestamp=None, **kwargs):
         buf = self.buffer.get()
         logger.debug("received %d characters", len(buf))
-        if len(buf) != 928:
-            logger.debug("not exactly 928 bytes: %d", len(buf))
+        if len(buf) != PACKET_SIZE:
+            logger.debug("not exactly %d bytes: %d", PACKET_SIZE, len(buf))
             return
 
         def uint16(i):
             "convert two bytes at offset i to a 16-bit unsigned integer"
             return buf[i]*256+buf[i+1]
 
-        def bykey(pid, default=None):
-            "return parameter by parameter ID"
-            try:
-                par = param[pid]
-                return par
-            except KeyError:
-                logger.debug("paramID %d not found: number of parameters = %d", pid, len(param))
-
-        param = {}
-        for i in range(4, 924, 4):
-            param[uint16(i)] = uint16(i+2)
-        logger.debug("interpreted %d parameters", len(param))
-        if len(param) != 230:
-            logger.debug("expected 230 parameters, found %d", len(param))
-            return
-
-        cid = param.get(1028)
+        offsets = self.offsets
+        if len(offsets) == 0 or any(uint16(offsets[pid]-2) != pid for pid in PARAMETERS):
+            # new packet layout: find the parameters once, by the ID sequence
+            ids = tuple(uint16(i) for i in range(4, PACKET_SIZE-4, 4))
+            offsets = self.layouts.get(ids)
+            if offsets is None:
+                offsets = {
+                    pid: 4 + 4*column + 2
+                    for column, pid in enumerate(ids)
+                    if pid in PARAMETERS
+                }
+                self.layouts[ids] = offsets
+                logger.debug("new layout of %d parameters", len(ids))
+            if len(offsets) != len(PARAMETERS):
+                logger.debug("expected %d parameters, found %d", len(PARAMETERS), len(offsets))
+                return
+            self.offsets = offsets
+
+        cid = uint16(offsets[CONTROLLER_NUMBER])
         if self.cid.get() > 0 and cid != self.cid.get():
             # filter out packets from other controllers
             return
         logger.debug("Controller ID %d", cid)
+        param = {pid: uint16(offsets[pid]) for pid in PARAMETERS}
 
-        csum = uint16(924)
+        csum = uint16(PACKET_SIZE-4)
         # if csum == self.cksum:
         #     logger.debug("checksum not changed")
         #     return
@@ -90,24 +104,24 @@ class CS800(ophyd.Device):
         self.cksum = csum
         self.params = param
 
-        phase_code = bykey(1054, -1)
+        phase_code = param[PHASE_ID]
         if phase_code is not None and phase_code in range(0, len(self._phase_ids)):
             phase = self._phase_ids[phase_code]
         else:
             phase = f"phase:{phase_code}"
 
-        self.alarm_code.put(bykey(1065))
+        self.alarm_code.put(param[ALARM_CODE])
         # self.mac.put(f"{param[1311]:04x}{param[1312]:04x}{param[1313]:04x}")
         self.phase.put(phase)
-        self.setpoint.put(param[1050]*0.01)
-        self.temperature.put(param[1051]*0.01)
+        self.setpoint.put(param[GAS_SET_POINT]*0.01)
+        self.temperature.put(param[GAS_TEMP]*0.01)
 
         logger.info("update: %s", str(self.succinct()))
 
     def setup(self, cid):
         self.cid.put(cid)
         self.wait_for_connection()
-        self.nrrd.put(928)
+        self.nrrd.put(PACKET_SIZE)
         self.ifmt.put("Binary")
         # self.scan.put("I/O Intr")
         self.tmod.put("Read")
@@ -121,7 +135,7 @@ class CS800(ophyd.Device):
             "("
             f"{dt:03f}"
             f",{self.cid.get()}"
-            f",{self.params.get(1028,0)}"
+            f",{self.params.get(CONTROLLER_NUMBER,0)}"
             # f"{self.mac.get()}"
             f",{hex(self.cksum)}"
             "):"
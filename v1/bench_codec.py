@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+throughput of the codec module against the original pure-Python helpers
+
+USAGE::
+
+    ./bench_codec.py [-n NUMBER]
+"""
+
+import argparse
+import random
+import timeit
+
+import codec
+
+
+# original helpers from utils, before the codec module
+
+def legacy_checksum(byte_list, basis=1):
+    limit = 2**(8*basis)
+    return sum([c for c in byte_list]) % limit
+
+
+def legacy_i2bs(i):
+    bs = []
+    while i > 0:
+        bs.append(i % 256)
+        i = i // 256
+    return bytes(reversed(bs))
+
+
+def legacy_bs2i(bs):
+    i = 0
+    for b in bs:
+        i = i*256 + b
+    return i
+
+
+def legacy_encode2bytes(n):
+    if n > 255:
+        return legacy_i2bs(n)
+    else:
+        return bytes((0, n))
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    parser = argparse.ArgumentParser(
+        prog='bench_codec',
+        description="compare the codec module with the original helpers")
+    parser.add_argument(
+        '-n',
+        dest='number',
+        type=int,
+        default=2000,
+        help="repetitions of each test (default: 2000)")
+    return parser.parse_args()
+
+
+def main():
+    user_parms = get_user_parameters()
+    n = user_parms.number
+
+    # one full status packet worth of ID/value pairs
+    words = []
+    for pid in range(1000, 1230):
+        words += [pid, random.randint(256, 30000)]
+    data = codec.pack_u16_array(words)
+
+    tests = {
+        "encode 460 words": (
+            lambda: b"".join(legacy_encode2bytes(w) for w in words),
+            lambda: codec.pack_u16_array(words),
+        ),
+        "decode 460 words": (
+            lambda: [legacy_bs2i(data[i:i+2]) for i in range(0, len(data), 2)],
+            lambda: codec.unpack_u16_array(data),
+        ),
+        "16-bit checksum": (
+            lambda: legacy_checksum(data, 2),
+            lambda: codec.checksum16(data),
+        ),
+        "command packet": (
+            lambda: (lambda m: m + legacy_i2bs(legacy_checksum(m)))(
+                legacy_encode2bytes(11) + legacy_encode2bytes(360)
+                + legacy_encode2bytes(15000)),
+            lambda: codec.pack_command(11, 360, 15000),
+        ),
+    }
+
+    print(f"{'test':20s} {'legacy/s':>12s} {'codec/s':>12s} {'speedup':>8s}")
+    for title, (legacy, fast) in tests.items():
+        t_legacy = timeit.timeit(legacy, number=n)
+        t_fast = timeit.timeit(fast, number=n)
+        print(
+            f"{title:20s}"
+            f" {n/t_legacy:12.0f}"
+            f" {n/t_fast:12.0f}"
+            f" {t_legacy/t_fast:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
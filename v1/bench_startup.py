@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+time from starting a simulator to its first status packet
+
+Starts ``cs800.py`` (with any extra arguments) several times and
+measures how long each takes to broadcast its first status packet.
+
+USAGE::
+
+    ./bench_startup.py [-n NUMBER] [-- CS800_ARGS ...]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import receiver
+import status_listener
+
+
+def time_to_first_packet(listener, args, timeout=30.0):
+    """start the simulator, return seconds until its first status packet"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cs800.py")
+    while len(listener.receive(0)) > 0:
+        pass        # packets from earlier runs
+    t0 = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, path] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        while time.monotonic() - t0 < timeout:
+            if len(listener.receive(timeout)) > 0:
+                return time.monotonic() - t0
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    parser = argparse.ArgumentParser(
+        prog='bench_startup',
+        description="time from starting cs800.py to its first status packet")
+    parser.add_argument(
+        '-n',
+        dest='number',
+        type=int,
+        default=5,
+        help="number of starts (default: 5)")
+    parser.add_argument(
+        'args',
+        nargs='*',
+        help="arguments for cs800.py (after --)")
+    return parser.parse_args()
+
+
+def main():
+    user_parms = get_user_parameters()
+    listener = receiver.BatchReceiver(status_listener.STATUS_PORT)
+    times = []
+    for _ in range(user_parms.number):
+        t = time_to_first_packet(listener, user_parms.args)
+        if t is None:
+            print("no status packet received")
+            continue
+        times.append(t)
+    if len(times) > 0:
+        print(
+            f"time to first packet ({len(times)} starts):"
+            f" min {min(times)*1e3:.0f} ms"
+            f", median {statistics.median(times)*1e3:.0f} ms"
+            f", max {max(times)*1e3:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,32 +4,83 @@
 emit status of CS800 controller via UDP broadcast
 """
 
-import json
 import logging
-import numpy as np
-import os
+import math
+import random
 import socket
-import time
 
+import clocks
+import id_registry
+import scheduler
+import status_packet
+import tracing
 import utils
 
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
+NOISE_REDRAW = 1.0      # fraction of the noisy values drawn anew each tick
+
 
 def rand(base, width):
-    return round(base + width*np.random.random())
+    return round(base + width*random.random())
 
 
 def rand_norm(base, width):
-    return base + width*np.random.standard_normal()
+    return random.gauss(base, width)
 
 
 def irand_norm(base, width):
     return round(rand_norm(base, width))
 
 
+class NoisyParameters:
+    """
+    a class of parameters that fluctuate about a common base value
+
+    Each ``update()`` redraws the next `redraw` fraction of the
+    values (in turn), with one batched call to the random number
+    generator.  By default (1) every value changes every tick.  With
+    a smaller fraction, each value holds for 1/`redraw` ticks: fewer
+    parameters change per tick and the status packet is re-encoded
+    incrementally (see ``status_packet.StatusEncoder``).
+
+    NumPy is imported when the first class of parameters is made,
+    not with this module.
+    """
+
+    def __init__(self, keys, base, width, integer=False, redraw=NOISE_REDRAW):
+        import numpy as np
+
+        self.np = np
+        self.keys = list(keys)
+        self.base = base
+        self.width = width
+        self.integer = integer
+        self.count = max(1, math.ceil(len(self.keys)*redraw))     # per update
+        self.values = np.full(len(self.keys), float(base))
+        self._next = 0
+        self._drawn = False     # the first update draws all the values
+
+    def update(self, memory):
+        """draw new values for the next parameters and write them to `memory`"""
+        n = len(self.keys)
+        if n == 0:
+            return
+        np = self.np
+        count = self.count if self._drawn else n
+        self._drawn = True
+        index = np.arange(self._next, self._next + count) % n
+        self._next = (self._next + count) % n
+        values = self.base + self.width*np.random.standard_normal(len(index))
+        if self.integer:
+            values = np.rint(values).astype(int)
+        self.values[index] = values
+        keys = self.keys
+        memory.update(zip([keys[i] for i in index.tolist()], values.tolist()))
+
+
 class CS800:
     """
     simulate the CS800 controller
@@ -53,7 +104,8 @@ class CS800:
         StatusAlarmCode
         """.split()
 
-    def __init__(self):
+    def __init__(self, clock=None, noise_redraw=NOISE_REDRAW):
+        self.clock = clock or clocks.RealClock()
         self.udp_port = 30304			        # CS800 status broadcast port
         self.udp_host = "255.255.255.255"        # or "<broadcast>"
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -61,18 +113,25 @@ class CS800:
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self.sock.settimeout(0.2)
 
-        self.status_keys = utils.EPICS_PARAMETERS
+        # status packet formats, selected by SETSTATUSFORMAT
+        self.encoders = {}
+        self.define_status_format(utils.STATUS_FORMAT_FULL, utils.STATUS_IDS.keys())
+        self.define_status_format(
+            utils.STATUS_FORMAT_EPICS,
+            [k for k in utils.STATUS_IDS if k in utils.EPICS_PARAMETERS])
+        self.status_format = utils.STATUS_FORMAT_FULL
         # self.offset_temperature = 2.5   # add realism to simulator
         self.smoothing = 0.90   # 0 .. 1 : higher is slower to converge
         self.noise_amplitude = 0.1       # RMS fluctuations, K
 
         # set some initial values, not typical though
-        self.memory = {k: utils.bs2i(v) for k, v in utils.STATUS_IDS.items()}
+        self.memory = status_packet.StatusMemory(
+            zip(id_registry.NAMES, id_registry.IDS))
         self.memory["StatusGasSetPoint"] = 100.0
         self.memory["StatusGasTemp"] = 100.0
         self.memory["StatusTargetTemp"] = 100.0
         self.memory["StatusRunTime"] = 0.0
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
 
         self.run_mode = "Startup"
         self.phase_id = "Hold"
@@ -85,6 +144,24 @@ class CS800:
         self.memory["SetUpCommissionDate"] = rand(3330, 30)
         self.memory["DeviceH8Firmware"] = rand(1100, 30)
 
+        noisy = [k for k in utils.STATUS_IDS if k not in self.constant_parameters]
+        self.noisy_parameters = [
+            NoisyParameters(
+                [k for k in noisy if k in utils.TEMPERATURE_PARAMETERS],
+                150, 5, redraw=noise_redraw),
+            NoisyParameters(
+                [k for k in noisy if k in utils.PERCENT_PARAMETERS],
+                30, 5, integer=True, redraw=noise_redraw),
+            NoisyParameters(
+                [
+                    k
+                    for k in noisy
+                    if k not in utils.TEMPERATURE_PARAMETERS
+                    and k not in utils.PERCENT_PARAMETERS
+                ],
+                500, 50, integer=True, redraw=noise_redraw),
+        ]
+
         self.readGasTemp()
 
     @property
@@ -102,6 +179,35 @@ class CS800:
             self._phase_id = utils.PHASE_IDS[phase]
             self.memory["StatusPhaseId"] = self.phase_id
 
+    def define_status_format(self, number, keys):
+        """
+        define status packet format `number` to report the parameters `keys`
+
+        The packet layout of each format is precompiled when it is defined.
+        """
+        unknown = [k for k in keys if k not in utils.STATUS_IDS]
+        if len(unknown) > 0:
+            raise KeyError(f"unknown status parameter(s): {unknown}")
+        self.encoders[number] = status_packet.StatusEncoder(keys)
+
+    @property
+    def status_format(self):
+        return self._status_format
+
+    @status_format.setter
+    def status_format(self, number):
+        if number in self.encoders:
+            self._status_format = number
+            self.encoder = self.encoders[number]
+            self.encoder.invalidate()   # has not seen the recent changes
+            self.status_keys = self.encoder.keys
+            logger.info(
+                "status format %d: %d parameters, %d bytes",
+                number, len(self.status_keys), len(self.encoder))
+        else:
+            # unrecognised commands are ignored by the controller
+            logger.warning("status format %s is not defined", str(number))
+
     @property
     def run_mode(self):
         return utils.RUN_MODES.index(self._run_mode)
@@ -114,6 +220,10 @@ class CS800:
 
     def readGasTemp(self):
         "simulated temperatures"
+        with self.memory.transaction():
+            return self._readGasTemp()
+
+    def _readGasTemp(self):
         sp = self.memory["StatusGasSetPoint"]
         sp = max(80, min(300, sp))
         old = self.memory["StatusGasTemp"]
@@ -122,20 +232,14 @@ class CS800:
         value = eta*sp + (1 - eta)*old
         noise = rand_norm(0, self.noise_amplitude)
         self.memory["StatusGasTemp"] = value + noise
-        self.memory["StatusRunTime"] = (time.time() - self.start_time)/60.0
+        self.memory["StatusRunTime"] = (self.clock.time() - self.start_time)/60.0
         self.memory["StatusGasFlow"] = max(0, rand_norm(20, 5))
         self.memory["FlowBlockBackPressure"] = max(0, rand_norm(60, 5))
         self.memory["StatusAlarmCode"] = max(0, rand(0, 55))
 
-        self.memory["time"] = time.time()
-        for parm in utils.STATUS_IDS.keys():
-            if parm not in self.constant_parameters:
-                if parm in utils.TEMPERATURE_PARAMETERS:
-                        self.memory[parm] = rand_norm(150, 5)
-                elif parm in utils.PERCENT_PARAMETERS:
-                        self.memory[parm] = irand_norm(30, 5)
-                else:
-                    self.memory[parm] = irand_norm(500, 50)
+        self.memory["time"] = self.clock.time()
+        for group in self.noisy_parameters:
+            group.update(self.memory)
         return value
     
     def create_message(self):
@@ -157,43 +261,50 @@ class CS800:
         * FOOTER _BYTE1, FOOTER _BYTE2 - unique 16-bit footer
 
         The HEADER is defined as 0xAAAB and the FOOTER is defined as 0xABAA.
-        """
 
-        header = bytes((0xaa, 0xab))
-        footer = bytes((0xab, 0xaa))
+        The packet layout is fixed, so it is precompiled once (see
+        ``status_packet.StatusEncoder``) and only the values that
+        changed since the last packet are written here.
 
-        data = b""
-        for parm in utils.STATUS_IDS.keys():
-            parm_id = utils.STATUS_IDS[parm]
-            value = self.memory[parm]
-            if parm in utils.TEMPERATURE_PARAMETERS:
-                value = int(value*100 + 0.5)    # report T in centiKelvin
-            data += parm_id + utils.encode2bytes(int(value))
-            # ll = len(data)
-            # logger.debug("%d ParamID=%s: msg=%s", ll, parm, parm_id + utils.encode2bytes(value))
-
-        data_size = utils.encode2bytes(len(data))
-        cksum = utils.encode2bytes(utils.checksum(data, 2))
-
-        msg = header + data_size + data + cksum + footer
+        The values come from an immutable snapshot of ``memory``
+        so a packet never mixes old and new values of one update.
+        """
+        msg = self.encoder.encode_snapshot(self.memory.snapshot())
         logger.debug("status message: %s", msg)
         return msg
 
-    def emit_status(self):
+    def next_message(self):
+        """advance the simulation by one tick, return the status message"""
+        self.readGasTemp()
+        # print(self.memory)
+        msg = self.create_message()
+        tracing.tracer.published(self.encoder.version)
+        logger.debug("msg = %s", msg)
+        return msg
+
+    def emit_status(self, rate=1.0, overrun=scheduler.SKIP, timers=None):
         """
         send the status of this controller
 
         Only send the values from `self.status_keys`, not everything
-        since this is configurable on the controller.
-        """
-        while True:
-            self.readGasTemp()
-            # print(self.memory)
-            msg = self.create_message()
-            logger.debug("msg = %s", msg)
-            self.sock.sendto(msg, (self.udp_host, self.udp_port))
-            time.sleep(1)
+        since this is configurable on the controller
+        (see ``status_format``).
+
+        Status is sent at `rate` (Hz, default: 1) against monotonic
+        deadlines so the period does not drift.  The `overrun` policy
+        (see ``scheduler``) decides what to do with missed deadlines.
 
+        With `timers` (a ``scheduler.TimerScheduler``), the broadcasts are
+        added to it and this returns at once, otherwise this runs forever.
+        """
+        def send():
+            self.sock.sendto(self.next_message(), (self.udp_host, self.udp_port))
+
+        if timers is not None:
+            self.scheduler = timers.add(send, rate, overrun)
+            return
+        self.scheduler = scheduler.DeadlineScheduler(rate, overrun, self.clock)
+        self.scheduler.run(send)
 
 if __name__ == "__main__":
     cs800 = CS800()
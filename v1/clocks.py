@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+clocks for the simulator: real, scaled, or virtual time
+
+All parts of the simulator that need the time (state machine,
+thermal model, status scheduler) ask a clock object, so the
+same code can run in:
+
+============  =========================================================
+clock         time
+============  =========================================================
+RealClock     wall-clock time
+ScaledClock   wall-clock time, accelerated by a constant factor (e.g. 100x)
+VirtualClock  discrete-event time: the clock jumps to the next wake-up
+              as soon as every participating thread is sleeping
+============  =========================================================
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RealClock:
+    """wall-clock time"""
+
+    def time(self):
+        """seconds since the epoch"""
+        return time.time()
+
+    def monotonic(self):
+        """seconds, for measuring intervals"""
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """wait `seconds`"""
+        time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        """wait `seconds`, in an asyncio task"""
+        import asyncio
+
+        await asyncio.sleep(seconds)
+
+    def wait(self, event, seconds=None):
+        """
+        wait for the ``threading.Event`` `event`, up to `seconds` (None: forever)
+
+        Returns True if the event is set.
+        """
+        return event.wait(self.real(seconds))
+
+    async def wait_async(self, event, seconds=None):
+        """
+        wait for the ``asyncio.Event`` `event`, up to `seconds` (None: forever)
+
+        Returns True if the event is set.
+        """
+        import asyncio
+
+        try:
+            await asyncio.wait_for(event.wait(), self.real(seconds))
+        except asyncio.TimeoutError:
+            pass
+        return event.is_set()
+
+    def real(self, seconds):
+        """real time for `seconds` of this clock"""
+        return seconds
+
+
+class ScaledClock(RealClock):
+    """
+    wall-clock time, running `factor` times faster than real time
+
+    The clock starts at the real time when it is created.
+    """
+
+    def __init__(self, factor):
+        if factor <= 0:
+            raise ValueError(f"factor must be positive, received {factor}")
+        self.factor = factor
+        self.t0 = time.time()
+        self.m0 = time.monotonic()
+
+    def time(self):
+        return self.t0 + (time.time() - self.t0)*self.factor
+
+    def monotonic(self):
+        return self.m0 + (time.monotonic() - self.m0)*self.factor
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds)/self.factor)
+
+    async def sleep_async(self, seconds):
+        import asyncio
+
+        await asyncio.sleep(max(0, seconds)/self.factor)
+
+    def real(self, seconds):
+        if seconds is None:
+            return None
+        return max(0, seconds)/self.factor
+
+
+class VirtualClock(RealClock):
+    """
+    discrete-event time
+
+    A call to ``sleep()`` blocks until the virtual time reaches the
+    wake-up time.  When all `participants` threads are sleeping,
+    the clock jumps directly to the earliest wake-up time.  Time does
+    not advance otherwise, so a thread that is not a participant (such
+    as one waiting for a UDP command) must not call ``sleep()``.
+
+    Use ``advance()`` to move the time forward from outside.
+
+    The participants are either all threads (``sleep()``, ``wait()``)
+    or all asyncio tasks of one event loop (``sleep_async()``,
+    ``wait_async()``).
+
+    A participant that waits for an event checks it every `idle_period`
+    (virtual seconds) or at the end of the wait, whichever comes first.
+    """
+
+    idle_period = 1.0
+
+    def __init__(self, start=None, participants=1):
+        self.now = time.time() if start is None else start
+        self.participants = participants
+        self._sleepers = []     # heap of wake-up times
+        self._cond = threading.Condition()
+        self._async_sleepers = []   # heap of (wake-up time, count, future)
+        self._count = itertools.count()
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._cond:
+            wake = self.now + max(0, seconds)
+            heapq.heappush(self._sleepers, wake)
+            while self.now < wake:
+                if (
+                        len(self._sleepers) >= self.participants
+                        and self._sleepers[0] > self.now
+                ):
+                    # everyone is waiting: jump to the next event
+                    self.now = self._sleepers[0]
+                    self._cond.notify_all()
+                else:
+                    self._cond.wait()
+            self._sleepers.remove(wake)
+            heapq.heapify(self._sleepers)
+
+    async def sleep_async(self, seconds):
+        """
+        wait until the virtual time reaches now + `seconds`, in an asyncio task
+
+        The last participant task to sleep moves the clock to the
+        earliest wake-up time and wakes the tasks that are due.
+        """
+        import asyncio
+
+        wake = self.now + max(0, seconds)
+        if wake <= self.now:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._async_sleepers, (wake, next(self._count), future))
+        if len(self._async_sleepers) >= self.participants:
+            self._wake_async()
+        await future
+
+    def _wake_async(self):
+        """everyone is waiting: jump to the next event, wake who is due"""
+        sleepers = self._async_sleepers
+        self.now = max(self.now, sleepers[0][0])
+        while len(sleepers) > 0 and sleepers[0][0] <= self.now:
+            _wake, _count, future = heapq.heappop(sleepers)
+            if not future.done():   # not cancelled
+                future.set_result(None)
+
+    def wait(self, event, seconds=None):
+        if seconds is None or seconds > self.idle_period:
+            seconds = self.idle_period
+        if not event.is_set():
+            self.sleep(seconds)
+        return event.is_set()
+
+    async def wait_async(self, event, seconds=None):
+        if seconds is None or seconds > self.idle_period:
+            seconds = self.idle_period
+        if not event.is_set():
+            await self.sleep_async(seconds)
+        return event.is_set()
+
+    def advance(self, seconds):
+        """move the virtual time forward by `seconds`"""
+        with self._cond:
+            self.now += max(0, seconds)
+            self._cond.notify_all()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+pack and unpack the binary fields of CS800 packets
+
+All fields are 16-bit unsigned, big-endian.  Checksums are the
+simple sum of the bytes, modulo 8 bits (commands) or 16 bits (status).
+
+The functions accept ``bytes``, ``bytearray`` or ``memoryview``.
+Values that do not fit in 16 bits are either rejected (``ValueError``)
+or clamped to 0 .. 65535, as selected by the `policy` argument.
+"""
+
+import functools
+import struct
+
+UINT16 = struct.Struct(">H")
+UINT16_MAX = 0xffff
+COMMAND = struct.Struct(">HHHB")    # command ID, arg1, arg2, checksum
+
+REJECT = "reject"
+CLAMP = "clamp"
+
+
+def uint16(value, policy=REJECT):
+    """return `value` as an integer that fits in 16 bits"""
+    value = int(value)
+    if 0 <= value <= UINT16_MAX:
+        return value
+    if policy == CLAMP:
+        return min(max(value, 0), UINT16_MAX)
+    raise ValueError(f"value {value} does not fit in 16 bits")
+
+
+def pack_u16(value, policy=REJECT):
+    """return `value` as 2 bytes, big-endian"""
+    return UINT16.pack(uint16(value, policy))
+
+
+def unpack_u16(data, offset=0):
+    """return the 16-bit value at `offset` of `data`"""
+    return UINT16.unpack_from(data, offset)[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _u16_array(count):
+    return struct.Struct(f">{count}H")
+
+
+def pack_u16_array(values, policy=REJECT):
+    """return the sequence of `values` as 16-bit big-endian words"""
+    values = [uint16(v, policy) for v in values]
+    return _u16_array(len(values)).pack(*values)
+
+
+def unpack_u16_array(data, offset=0, count=None):
+    """return a tuple of the 16-bit values in `data`, starting at `offset`"""
+    if count is None:
+        count = (len(data) - offset) // 2
+    return _u16_array(count).unpack_from(data, offset)
+
+
+def checksum8(data):
+    """8-bit sum of the bytes of `data`"""
+    return sum(data) & 0xff
+
+
+def checksum16(data):
+    """16-bit sum of the bytes of `data`"""
+    return sum(data) & UINT16_MAX
+
+
+def pack_command(command_id, arg1=0, arg2=0, policy=REJECT):
+    """return the 7-byte command packet, with its checksum"""
+    words = [uint16(v, policy) for v in (command_id, arg1, arg2)]
+    cksum = sum((w >> 8) + (w & 0xff) for w in words) & 0xff
+    return COMMAND.pack(*words, cksum)
+
+
+def unpack_command(data):
+    """
+    return (command_id, arg1, arg2) from the 7-byte command packet
+
+    Raises ``ValueError`` if the length or the checksum is wrong.
+    """
+    if len(data) != COMMAND.size:
+        raise ValueError(f"Command message wrong length {len(data)}")
+    command_id, arg1, arg2, cksum = COMMAND.unpack(data)
+    if checksum8(memoryview(data)[:6]) != cksum:
+        raise ValueError("Command checksum error")
+    return command_id, arg1, arg2
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+bounded, thread-safe queue of command requests for the state machine
+
+Commands arrive from the UDP receive thread (or task) and are consumed
+by the state machine.  A client that retries commands in a tight loop
+must not grow the queue (or the latency of the commands behind them):
+
+============  ==============================================================
+protection    what happens
+============  ==============================================================
+coalesce      a command that supersedes the last queued one replaces it
+              (consecutive RAMPs or COOLs keep only the last target);
+              other commands are program steps and are all kept
+rate limit    each source (IP address) may send `source_rate` commands/s,
+              with bursts of up to `source_burst`; the rest are dropped
+overflow      when `maxlen` commands are waiting, ``drop-newest`` rejects
+              the new command, ``drop-oldest`` discards the oldest one
+============  ==============================================================
+"""
+
+import collections
+import logging
+import threading
+
+import clocks
+
+logger = logging.getLogger(__name__)
+
+DROP_NEWEST = "drop-newest"
+DROP_OLDEST = "drop-oldest"
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST)
+
+SUPERSEDING_COMMANDS = ("RAMP", "COOL")
+MAX_SOURCES = 1024      # forget idle sources beyond this many
+
+
+class CommandQueue:
+    """
+    bounded FIFO of command requests (dicts from ``controller.decode_command()``)
+
+    USAGE::
+
+        queue = CommandQueue(maxlen=64)
+        queue.put(request)      # from the receiving thread
+        request = queue.get()   # from the state machine, None if empty
+    """
+
+    def __init__(
+            self, maxlen=64, overflow=DROP_NEWEST,
+            source_rate=50.0, source_burst=20, clock=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow must be one of {OVERFLOW_POLICIES}, received '{overflow}'")
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.source_rate = source_rate      # commands/s from each source
+        self.source_burst = source_burst
+        self.clock = clock or clocks.RealClock()
+        self.lock = threading.Lock()
+        self._queue = collections.deque()
+        self._sources = {}                  # ip: [tokens, time]
+
+        self.received = 0       # commands offered to put()
+        self.coalesced = 0      # commands merged with the last queued one
+        self.rate_limited = 0   # commands dropped by the per-source limit
+        self.overflows = 0      # commands dropped because the queue was full
+        self.max_depth = 0      # most commands waiting at once
+        self._full = False      # warned about the overflow already
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"depth={len(self._queue)}"
+            f", max_depth={self.max_depth}"
+            f", received={self.received}"
+            f", coalesced={self.coalesced}"
+            f", rate_limited={self.rate_limited}"
+            f", overflows={self.overflows})"
+        )
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self._queue))
+
+    def _allow(self, source):
+        """token bucket: may `source` send another command now?"""
+        now = self.clock.monotonic()
+        bucket = self._sources.get(source)
+        if bucket is None:
+            if len(self._sources) >= MAX_SOURCES:
+                self._sources.clear()
+            bucket = self._sources[source] = [self.source_burst, now]
+        tokens = min(
+            self.source_burst,
+            bucket[0] + (now - bucket[1]) * self.source_rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def put(self, request):
+        """
+        add `request` at the end of the queue
+
+        Returns False if the request was dropped (rate limit or overflow).
+        """
+        cmd = request.get("command_id")
+        with self.lock:
+            self.received += 1
+            source = request.get("ip")
+            if source is not None and not self._allow(source):
+                self.rate_limited += 1
+                logger.debug("rate limit, dropped %s from %s", cmd, source)
+                return False
+
+            queue = self._queue
+            if len(queue) > 0:
+                last = queue[-1]
+                if cmd in SUPERSEDING_COMMANDS and last.get("command_id") == cmd:
+                    queue[-1] = request
+                    self.coalesced += 1
+                    return True
+
+            if len(queue) >= self.maxlen:
+                self.overflows += 1
+                if not self._full:      # once, until the queue drains
+                    logger.warning(
+                        "command queue full (%d), %s", self.maxlen, self.overflow)
+                    self._full = True
+                if self.overflow == DROP_NEWEST:
+                    return False
+                queue.popleft()
+
+            queue.append(request)
+            self.max_depth = max(self.max_depth, len(queue))
+            return True
+
+    def get(self):
+        """remove and return the first request, None if the queue is empty"""
+        with self.lock:
+            if len(self._queue) == 0:
+                self._full = False
+                return None
+            return self._queue.popleft()
+
+    def peek(self):
+        """return the first request (without removing it), None if empty"""
+        with self.lock:
+            return self._queue[0] if len(self._queue) > 0 else None
+
+    def replace(self, requests=()):
+        """discard all waiting requests, then queue `requests` (not limited)"""
+        with self.lock:
+            self._queue.clear()
+            self._queue.extend(requests)
+
+    def prepend(self, requests):
+        """queue `requests` (not limited) ahead of the waiting ones"""
+        with self.lock:
+            self._queue.extendleft(reversed(list(requests)))
+
+    def metrics(self):
+        """return the queue counters as a dict"""
+        with self.lock:
+            return dict(
+                depth=len(self._queue),
+                max_depth=self.max_depth,
+                received=self.received,
+                coalesced=self.coalesced,
+                rate_limited=self.rate_limited,
+                overflows=self.overflows,
+            )
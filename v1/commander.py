@@ -10,10 +10,13 @@ NOTE: The CS800 will not reply.
 """
 
 import datetime
+import functools
 import logging
+import select
 import socket
 import time
 
+import codec
 import utils
 
 logging.basicConfig(level=logging.DEBUG)
@@ -22,6 +25,50 @@ logger = logging.getLogger(__name__)
 
 COMMAND_PORT = 30305
 REVERSE_IDS = {v:k for k, v in utils.COMMAND_IDS.items()}
+SNDBUF_SIZE = 1024 * 1024
+
+_command_socket = None
+
+
+def command_socket():
+    """return the UDP socket shared by all command senders of this process"""
+    global _command_socket
+    if _command_socket is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF_SIZE)
+        sock.setblocking(False)
+        _command_socket = sock
+    return _command_socket
+
+
+def send_packet(packet, addresses, sock=None):
+    """
+    send `packet` to every (host, port) in `addresses`, return the number sent
+
+    The socket does not block: when its buffer is full, wait until it
+    can take more, then continue with the rest of the addresses.
+    """
+    sock = sock or command_socket()
+    sent = 0
+    for address in addresses:
+        while True:
+            try:
+                sock.sendto(packet, address)
+                sent += 1
+            except BlockingIOError:
+                select.select([], [sock], [], 1.0)
+                continue
+            except OSError as exc:
+                logger.warning("%s: %s", address[0], exc)
+            break
+    return sent
+
+
+@functools.lru_cache(maxsize=None)
+def command_packet(command, arg1=0, arg2=0):
+    """return the 7-byte packet of `command` (name), computed once"""
+    command_id = codec.unpack_u16(utils.COMMAND_IDS[command.upper()])
+    return codec.pack_command(command_id, arg1, arg2)
 
 
 class CS800controller:
@@ -29,11 +76,10 @@ class CS800controller:
     send commands to a CS8000 controller (replies are not in the spec)
     """
 
-    def __init__(self, cs800_host):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        # # Enable broadcasting mode
-        # self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    def __init__(self, cs800_host, confirmer=None):
+        self.sock = command_socket()
         self.host = cs800_host
+        self.confirmer = confirmer  # confirm.Confirmer, optional
         # self.sock.bind((cs800_host, COMMAND_PORT))
 
         logger.info("Send commands to '%s' on port %d", cs800_host, COMMAND_PORT)
@@ -41,23 +87,25 @@ class CS800controller:
     def send_command(self, command, arg1=0, arg2=0):
         """
         send CS800 command via UDP
+
+        With a `confirmer`, return its ``confirm.PendingCommand``.
         """
+        if self.confirmer is not None:
+            return self.confirmer.send(self.host, command, arg1, arg2)
         # COMMAND_ID (high byte), COMMAND_ID (low byte)
         # PARAM1 (high byte), PARAM1 (low byte)
         # PARAM2 (high byte), PARAM2 (low byte)
         # CHECKSUM_BYTE - an 8-bit sum of bytes. 
-        command_id = utils.COMMAND_IDS[command.upper()]
-        msg = command_id + utils.encode2bytes(arg1) + utils.encode2bytes(arg2)
-        msg += utils.i2bs(utils.checksum(msg))
+        msg = command_packet(command, arg1, arg2)
         logger.debug("sending %s(%d,%d), length=%d: msg=%s", command, arg1, arg2, len(msg), msg)
-        self.sock.sendto(msg, (self.host, COMMAND_PORT))
+        send_packet(msg, [(self.host, COMMAND_PORT)], self.sock)
 
     def cool(self, setpoint):
         """
         cool to T=`setpoint`: 80 .. T now
         """
         if 80 <= setpoint <= 400:   # max should be current temperature
-            self.send_command("cool", int(setpoint*100 + 0.5))
+            return self.send_command("cool", int(setpoint*100 + 0.5))
 
     def end(self, rate):
         """
@@ -66,24 +114,24 @@ class CS800controller:
         * rate (K/hour): 1 .. 360
         """
         if 1 <= rate <= 360:
-            self.send_command("end", int(rate + 0.5))
+            return self.send_command("end", int(rate + 0.5))
 
     def pause(self):
         """pause"""
-        self.send_command("pause")
+        return self.send_command("pause")
 
     def plateau(self, duration):
         """
         hold for `duration` minutes` : 1 .. 1400
         """
         if 1 <= duration <= 1440:   # no longer than a day
-            self.send_command("plat", int(duration + 0.5))
+            return self.send_command("plat", int(duration + 0.5))
     
     plat = plateau
 
     def purge(self):
         """purge"""
-        self.send_command("purge")
+        return self.send_command("purge")
 
     def ramp(self, rate, setpoint):
         """
@@ -93,19 +141,25 @@ class CS800controller:
         * setpoint (K): 80 .. 400 (500 for + model)
         """
         if 1 <= rate <= 360 and 80 <= setpoint <= 400:
-            self.send_command("ramp", int(rate+0.5), int(setpoint*100 + 0.5))
+            return self.send_command("ramp", int(rate+0.5), int(setpoint*100 + 0.5))
 
     def restart(self):
         """restart"""
-        self.send_command("restart")
+        return self.send_command("restart")
 
     def resume(self):
         """resume"""
-        self.send_command("resume")
+        return self.send_command("resume")
+
+    def set_status_format(self, number):
+        """
+        select the status packet format: 0=full, 1=EPICS, others user-defined
+        """
+        return self.send_command("setstatusformat", int(number))
 
     def stop(self):
         """stop"""
-        self.send_command("stop")
+        return self.send_command("stop")
 
     def turbo(self, mode):
         """
@@ -113,7 +167,7 @@ class CS800controller:
         """
         if mode != utils.TURBO_ON:
             mode = utils.TURBO_OFF
-        self.send_command("turbo", mode)
+        return self.send_command("turbo", mode)
 
 
 def command_handler(host):
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+"""
+confirm commands by watching the status broadcasts of the controller
+
+The CS800 does not reply to commands.  A command is confirmed when
+a status packet from the controller shows its expected effect:
+
+===============  ==================  ===================
+command          status parameter    expected value
+===============  ==================  ===================
+RAMP, COOL       StatusTargetTemp    the new target
+PLAT             StatusPhaseId       Plat
+HOLD             StatusPhaseId       Hold
+END              StatusPhaseId       End
+PURGE            StatusPhaseId       Purge
+PAUSE            StatusPhaseId       Wait
+STOP             StatusRunMode       Shutdown OK
+RESTART          StatusRunMode       Startup OK
+===============  ==================  ===================
+
+A command is confirmed only by a change: a status packet received after
+the command was sent must show the expected value, and the packet before
+it (from the same controller) must not.  A packet already on its way when
+the command was sent, or a controller that is already in the expected
+state (such as HOLD while holding), does not confirm anything.  A command
+whose expected value is already shown when it is sent cannot be confirmed
+and is sent once, as are the other commands.  Start the confirmer before
+sending, so it knows the current values.
+
+An unconfirmed command is sent again after `timeout` s, doubling the
+timeout each time, up to `retries` times.
+
+Controllers are identified by IP address: a host name is resolved when
+the command is sent, and every address of this host counts as
+``127.0.0.1``.
+
+Pending confirmations are indexed by (controller IP, parameter, value),
+so each status packet costs one lookup per watched parameter, no matter
+how many commands are waiting.
+
+USAGE::
+
+    confirmer = Confirmer()
+    confirmer.start()       # listen for status in a thread
+    cs800 = commander.CS800controller("192.168.144.99", confirmer)
+    pending = cs800.ramp(360, 150)
+    if not pending.wait(10):
+        print("RAMP not confirmed")
+"""
+
+import heapq
+import itertools
+import logging
+import socket
+import threading
+import time
+
+import commander
+import receiver
+import status_packet
+import utils
+
+logger = logging.getLogger(__name__)
+
+STATUS_PORT = 30304
+TIMEOUT = 2.5       # s, longer than one status period (1 s)
+RETRIES = 3
+WATCHED = ("StatusTargetTemp", "StatusPhaseId", "StatusRunMode")
+EXPECTED_PHASES = dict(
+    PLAT="Plat", HOLD="Hold", END="End", PURGE="Purge", PAUSE="Wait")
+EXPECTED_RUN_MODES = dict(STOP="Shutdown OK", RESTART="Startup OK")
+LOOPBACK = "127.0.0.1"
+
+
+def local_addresses():
+    """return the set of the IPv4 addresses of this host"""
+    import psutil
+
+    return {
+        address.address
+        for addresses in psutil.net_if_addrs().values()
+        for address in addresses
+        if address.family == socket.AF_INET
+    } | {LOOPBACK}
+
+
+def expectation(command, arg1=0, arg2=0):
+    """
+    return the (parameter, value) that confirms `command`, None if none
+
+    Temperatures are in centiKelvin, phases and run modes are numbers,
+    as in the status packet.
+    """
+    command = command.upper()
+    if command == "RAMP":
+        return "StatusTargetTemp", arg2
+    elif command == "COOL":
+        return "StatusTargetTemp", arg1
+    elif command in EXPECTED_PHASES:
+        return "StatusPhaseId", utils.PHASE_IDS.index(EXPECTED_PHASES[command])
+    elif command in EXPECTED_RUN_MODES:
+        return "StatusRunMode", utils.RUN_MODES.index(EXPECTED_RUN_MODES[command])
+    return None
+
+
+class PendingCommand:
+    """a command sent to `host`, waiting for confirmation"""
+
+    def __init__(self, host, command, packet, key, timeout):
+        self.host = host            # as given to send()
+        self.command = command
+        self.packet = packet
+        self.key = key              # (IP address, parameter, value)
+        self.timeout = timeout      # s, until the next retransmission
+        self.attempts = 0           # number of times sent
+        self.sent = None            # time of the first send
+        self.confirmed = None       # time of the confirmation
+        self.failed = False         # all retries timed out
+        self.event = threading.Event()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"host='{self.host}'"
+            f", command='{self.command}'"
+            f", attempts={self.attempts}"
+            f", confirmed={self.confirmed is not None}"
+            f", failed={self.failed})"
+        )
+
+    @property
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """wait until confirmed or failed, return True if confirmed"""
+        self.event.wait(timeout)
+        return self.confirmed is not None
+
+
+class Confirmer:
+    """
+    send commands, confirm them from the status broadcasts, retransmit
+    """
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, port=STATUS_PORT):
+        self.timeout = timeout
+        self.retries = retries
+        self.receiver = receiver.BatchReceiver(port)
+        self.decoder = status_packet.StatusProjection(WATCHED)
+        self.lock = threading.Lock()
+        self.index = {}         # (IP, parameter, value): [PendingCommand, ...]
+        self.timers = []        # heap of (deadline, count, PendingCommand)
+        self.last = {}          # (IP, parameter): last value received
+        self.local = local_addresses()
+        self._count = itertools.count()
+
+        self.confirmed = 0      # commands confirmed
+        self.retransmitted = 0  # extra sends
+        self.failed = 0         # commands never confirmed
+
+    def __len__(self):
+        """number of commands waiting for confirmation"""
+        return sum(len(waiting) for waiting in self.index.values())
+
+    def address(self, host):
+        """return the IP address that identifies `host` in the status packets"""
+        ip = socket.gethostbyname(host)
+        return LOOPBACK if ip in self.local else ip
+
+    def send(self, host, command, arg1=0, arg2=0):
+        """
+        send `command` to `host`, return its PendingCommand
+
+        A command that cannot be confirmed (or whose expected value is
+        already shown by `host`) is sent once, its PendingCommand is
+        done (and not confirmed) immediately.
+        """
+        packet = commander.command_packet(command, arg1, arg2)
+        expected = expectation(command, arg1, arg2)
+        key = None
+        if expected is not None:
+            key = (self.address(host),) + expected
+            if self.last.get(key[:2]) == key[2]:
+                logger.info("%s to %s: nothing would change", command.upper(), host)
+                key = None
+        pending = PendingCommand(host, command.upper(), packet, key, self.timeout)
+        # sent before it is published: status_received() compares the time
+        pending.sent = time.monotonic()
+        pending.attempts = 1
+        if key is not None:
+            with self.lock:
+                self.index.setdefault(key, []).append(pending)
+        self._send(pending)
+        if key is None:
+            pending.event.set()
+        return pending
+
+    def _send(self, pending):
+        now = time.monotonic()
+        commander.send_packet(pending.packet, [(pending.host, commander.COMMAND_PORT)])
+        if pending.key is not None:
+            with self.lock:
+                heapq.heappush(
+                    self.timers,
+                    (now + pending.timeout, next(self._count), pending))
+
+    def _finish(self, pending, confirmed):
+        if confirmed:
+            pending.confirmed = time.monotonic()
+            self.confirmed += 1
+        else:
+            pending.failed = True
+            self.failed += 1
+            logger.warning("%s to %s: not confirmed", pending.command, pending.host)
+        pending.event.set()
+
+    def status_received(self, host, status, t=None):
+        """
+        confirm the commands to `host` whose effect is in `status`
+
+        `status` was received at `t` (``time.monotonic()``, default: now).
+        Only the commands sent before `t` are confirmed, and only by a
+        value that changed since the previous packet from `host`.
+        """
+        if host in self.local:
+            host = LOOPBACK
+        t = time.monotonic() if t is None else t
+        for parameter in WATCHED:
+            value = status.get(parameter)
+            if value is None:
+                continue
+            if parameter == "StatusTargetTemp":
+                value = round(value * 100)      # K to centiK
+            value = int(value)
+            previous = self.last.get((host, parameter))
+            self.last[(host, parameter)] = value
+            if previous == value:
+                continue        # no change, nothing to confirm
+            key = (host, parameter, value)
+            waiting = self.index.get(key)
+            if waiting is None:
+                continue
+            for pending in [p for p in waiting if p.sent < t]:
+                waiting.remove(pending)
+                self._finish(pending, True)
+            if len(waiting) == 0:
+                del self.index[key]
+
+    def check_timers(self):
+        """send again the commands that timed out, give up after `retries`"""
+        now = time.monotonic()
+        retry = []
+        with self.lock:
+            while len(self.timers) > 0 and self.timers[0][0] <= now:
+                _deadline, _count, pending = heapq.heappop(self.timers)
+                if pending.done:
+                    continue
+                if pending.attempts > self.retries:
+                    waiting = self.index.get(pending.key, [])
+                    if pending in waiting:
+                        waiting.remove(pending)
+                        if len(waiting) == 0:
+                            del self.index[pending.key]
+                    self._finish(pending, False)
+                else:
+                    pending.timeout *= 2
+                    pending.attempts += 1
+                    retry.append(pending)
+        for pending in retry:
+            self.retransmitted += 1
+            logger.info("%s to %s: sending again", pending.command, pending.host)
+            self._send(pending)
+
+    def poll(self, timeout=0.1):
+        """receive the status packets ready (or wait `timeout` s), check timers"""
+        batch = self.receiver.receive(timeout)
+        t = time.monotonic()
+        for data, addr in batch:
+            try:
+                status = self.decoder.decode(data)
+                with self.lock:
+                    self.status_received(addr[0], status, t)
+            except status_packet.PacketError:
+                continue
+            except Exception as exc:
+                logger.error("%s: Exception: %s", addr[0], str(exc))
+        self.check_timers()
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as exc:
+                logger.error("Exception: %s", str(exc))
+
+    def start(self):
+        """listen for status and retransmit in a thread"""
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
@@ -9,14 +9,25 @@ controller's IP address and the command port 30305.
 If the command is unrecognised (Id invalid or Size inappropriate), 
 illegal (parameter out of range) or inappropriate (e.g. the 
 machine has shutdown), then it is simply ignored.
+
+Commands are received in batches (``receiver.BatchReceiver``), decoded
+on the receive thread with a lookup table of all 65536 command IDs,
+and handed to a worker thread that calls the callback, so a slow
+callback never blocks the receiver.  Invalid packets are counted
+by kind and logged at most once every ``ErrorLog.interval`` seconds.
 """
 
+import collections
 import datetime
 import logging
-import socket
+import queue
+import threading
 import time
 
-import utils
+import codec
+import id_registry
+import receiver
+import tracing
 
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -24,7 +35,40 @@ logger = logging.getLogger(__name__)
 
 COMMAND_PORT = 30305
 COMMAND_HOST = ""
-REVERSE_IDS = {v:k for k, v in utils.COMMAND_IDS.items()}
+COMMAND_TABLE = id_registry.COMMAND_NAME     # command ID: name
+WORKER_QUEUE_SIZE = 4096    # batches of commands waiting for the callback
+
+
+class ErrorLog:
+    """
+    count invalid packets by kind, log at most one every `interval` s
+
+    The number of errors not logged since the last message is added
+    to the next one.  The receive and worker threads both record errors.
+    """
+
+    interval = 10.0     # s
+
+    def __init__(self, interval=None):
+        if interval is not None:
+            self.interval = interval
+        self.counts = collections.Counter()     # kind: number of errors
+        self.suppressed = 0
+        self.last_time = None
+        self.lock = threading.Lock()
+
+    def error(self, kind, message):
+        now = time.monotonic()
+        with self.lock:
+            self.counts[kind] += 1
+            if self.last_time is not None and now - self.last_time < self.interval:
+                self.suppressed += 1
+                return
+            if self.suppressed > 0:
+                message += f" (+{self.suppressed} more errors: {dict(self.counts)})"
+            self.last_time = now
+            self.suppressed = 0
+        logger.error(message)
 
 
 class CS800controller:
@@ -33,61 +77,95 @@ class CS800controller:
     """
 
     def __init__(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        # Enable broadcasting mode
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.sock.bind((COMMAND_HOST, COMMAND_PORT))
+        self.receiver = receiver.BatchReceiver(COMMAND_PORT, COMMAND_HOST)
+        self.errors = ErrorLog()
+        self.work = queue.Queue(WORKER_QUEUE_SIZE)
+        self.received = 0       # valid commands received
+        self.dropped = 0        # valid commands dropped: worker queue full
 
         logger.info("Commands from '%s' on port %d", COMMAND_HOST, COMMAND_PORT)
 
     def handler(self, callback=None):
         """
         handle CS800 commands from UDP
+
+        Valid commands are passed to `callback(results)` on a worker thread.
         """
+        if callback is not None:
+            threading.Thread(target=self.worker, args=(callback,), daemon=True).start()
         while True:
-            data, addr = self.sock.recvfrom(1024)
+            batch = self.receiver.receive()
             t = time.time()
-            dt = datetime.datetime.fromtimestamp(t)
-            iso = dt.isoformat(sep=" ", timespec="milliseconds")
-            ip, port = addr
-            results = dict(
-                time=t,
-                datetime=iso,
-                ip=ip,
-                port=port,
-                )
-
-            if len(data) != 7:
-                results["error"] = f"Command message wrong length {len(data)}: {[int(c) for c in data]}"
-                logger.error(results["error"])
-                if callback is not None:
-                    callback(results)
+            t_received = time.monotonic()
+            commands = []
+            for data, addr in batch:
+                results = decode_command(data, addr, t)
+                if "error" in results:
+                    self.errors.error(results["error_kind"], results["error"])
+                else:
+                    logger.debug("command: %s", results)
+                    tracing.tracer.received(results, t_received)
+                    commands.append(results)
+            self.received += len(commands)
+            if callback is None or len(commands) == 0:
                 continue
-
-            # confirm the checksum or report CHECKSUM_ERROR
-            reported_cksum = utils.bs2i(data[6:])
-            calc_cksum = utils.checksum(data[:6], 1)
-            if calc_cksum != reported_cksum:
-                logger.error("Command checksum error")
-                results["error"] = "Command checksum error"
-                if callback is not None:
+            try:
+                self.work.put_nowait(commands)
+            except queue.Full:
+                self.dropped += len(commands)
+                self.errors.error("overflow", "command worker queue full")
+
+    def worker(self, callback):
+        """call `callback(results)` for every command received"""
+        while True:
+            for results in self.work.get():
+                try:
                     callback(results)
-                continue
+                except Exception as exc:
+                    self.errors.error("callback", f"Exception: {exc}")
 
-            # COMMAND_ID (high byte), COMMAND_ID (low byte)
-            # PARAM1 (high byte), PARAM1 (low byte)
-            # PARAM2 (high byte), PARAM2 (low byte)
-            # CHECKSUM_BYTE - an 8-bit sum of bytes. 
-            command_id = REVERSE_IDS[data[0:2]]
-            arg1 = utils.bs2i(data[2:4])
-            arg2 = utils.bs2i(data[4:6])
-
-            results["command_id"] = command_id
-            results["arg1"] = arg1
-            results["arg2"] = arg2
-            logger.debug("command: %s", str(results))
-            if callback is not None:
-                callback(results)
+
+def decode_command(data, addr, t=None):
+    """
+    return dict describing the command packet `data` received from `addr`
+
+    If the packet is not valid, the dict has an "error" key
+    (and "error_kind": "length", "checksum" or "unknown").
+    """
+    if t is None:
+        t = time.time()
+    dt = datetime.datetime.fromtimestamp(t)
+    iso = dt.isoformat(sep=" ", timespec="milliseconds")
+    ip, port = addr
+    results = dict(
+        time=t,
+        datetime=iso,
+        ip=ip,
+        port=port,
+        )
+
+    # COMMAND_ID (high byte), COMMAND_ID (low byte)
+    # PARAM1 (high byte), PARAM1 (low byte)
+    # PARAM2 (high byte), PARAM2 (low byte)
+    # CHECKSUM_BYTE - an 8-bit sum of bytes. 
+    try:
+        command_number, arg1, arg2 = codec.unpack_command(data)
+    except ValueError as exc:
+        # wrong length or CHECKSUM_ERROR
+        results["error"] = f"{exc}: {[int(c) for c in data]}"
+        results["error_kind"] = "length" if len(data) != codec.COMMAND.size else "checksum"
+        return results
+
+    command_id = COMMAND_TABLE[command_number]
+    if command_id is None:
+        results["error"] = f"Unknown command ID {command_number}"
+        results["error_kind"] = "unknown"
+        return results
+
+    results["command_id"] = command_id
+    results["arg1"] = arg1
+    results["arg2"] = arg2
+    return results
 
 
 def command_handler():
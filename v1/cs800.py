@@ -8,17 +8,30 @@ activity | code
 identity | `emit_id.announcer()`
 status | `broadcast_status.CS800().emit_status()`
 commands | `controller.CS800controller().handler()`
+
+The identity and status broadcasts are driven by one
+``scheduler.TimerScheduler``.  With ``--asyncio``, all of these (and
+the state machine) run as tasks of one asyncio event loop:
+``cs800.run_async()``.
 """
 
 import argparse
 import datetime
+import heapq
+import json
 import logging
 import threading
 import time
 
 import broadcast_status
+import clocks
+import command_queue
 import controller
 import emit_id
+import program
+import scheduler
+import tracing
+import utils
 
 
 logging.basicConfig(level=logging.INFO)
@@ -27,6 +40,8 @@ logger = logging.getLogger(__name__)
 
 cs800_status = None
 cs800_commands = None
+STARTUP_TIME = 1.0          # s, from "Startup OK" to "Run"
+VIRTUAL_HOST = "127.0.0.1"  # in virtual time, packets go out much faster than 1 Hz
 
 
 def run_in_thread(func):
@@ -69,17 +84,35 @@ class StateMachine:
     END             Bring the gas temperature to 300 K, then shut down. 
     PURGE           Bring the gas temperature and the internal temperature to 300 K then shut down. 
     ==============  ========================
+
+    When several RAMP, COOL, PLAT, END or PURGE commands are waiting
+    in the queue (or a program file is loaded), they are compiled into
+    one set point trajectory (``program.Program``) and run by ``do_program()``.
     """
 
     idle_phase = "Hold"
-
-    def __init__(self):
-        self.queue = []
+    min_delay = 0.01    # s, shortest wait between timed steps
+    max_delay = 1.0     # s, longest wait while following the gas temperature
+
+    def __init__(
+            self, clock=None, start=True,
+            queue_size=64, overflow=command_queue.DROP_NEWEST):
+        self.clock = clock or clocks.RealClock()
+        self.queue = command_queue.CommandQueue(queue_size, overflow, clock=self.clock)
         self.handler = self.idle
-        self.loop_delay = 0.1
+
+        # wake the event loop for a new command or the next timed deadline
+        self.timers = []                    # heap of (deadline, count, handler)
+        self._timer_count = 0
+        self.wake_event = threading.Event()
+        self._async_event = None
+        self._async_loop = None
 
         self.time_paused = 0
         self.phase_id_paused = None
+        self.handler_paused = None
+        self.program = None
+        self.program_start = 0.0
         self.paused = False
         self.target_time = 0.0
 
@@ -90,10 +123,23 @@ class StateMachine:
             "Ramp" : self.do_ramp,
         }
 
-        self.event_loop()
+        if start:
+            self.event_loop()
 
     def addCommand(self, request):
         "add a command request to the queue"
+        tracing.tracer.queued(request)
+        with cs800_status.memory.transaction():
+            self._addCommand(request)
+        self.wake()
+
+    def addProgram(self, steps):
+        "start a program of `steps` now, replacing any current activity"
+        with cs800_status.memory.transaction():
+            self.load_program(steps)
+        self.wake()
+
+    def _addCommand(self, request):
         cmd = request.get("command_id")
         if cmd == "HOLD":
             self.do_hold()
@@ -105,28 +151,86 @@ class StateMachine:
         elif cmd == "RESUME":           # ignore extra resumes
             if self.paused:
                 self.do_resume()
+        elif cmd == "SETSTATUSFORMAT":  # takes effect with the next packet
+            cs800_status.status_format = request["arg1"]
         elif not self.paused:           # only if not paused
-            self.queue.append(request)
+            self.queue.put(request)
+            return
+        self.dispatched(request)
+
+    def dispatched(self, request):
+        "trace: the effect of `request` is in the next status commit"
+        tracing.tracer.dispatched(request, cs800_status.memory.version + 1)
+
+    def wake(self):
+        "run the event loop now"
+        self.wake_event.set()
+        if self._async_loop is not None:
+            self._async_loop.call_soon_threadsafe(self._async_event.set)
+
+    def step(self):
+        """
+        run the handler of the current state
+
+        Returns the time (s) until the handler needs to run again,
+        or None if only a new command can change the state.
+        """
+        try:
+            # status broadcasts see all of the changes, or none
+            with cs800_status.memory.transaction():
+                return self.handler()
+        except Exception as exc:
+            logger.error("Exception: %s", str(exc))
+            return self.max_delay
+
+    def next_timeout(self, delay):
+        """
+        schedule the next step `delay` s from now, return time until next deadline
+        """
+        now = self.clock.time()
+        timers = self.timers
+        while len(timers) > 0 and (
+                timers[0][0] <= now                 # expired
+                or timers[0][2] != self.handler     # state has changed
+        ):
+            heapq.heappop(timers)
+        if delay is not None:
+            self._timer_count += 1
+            heapq.heappush(timers, (now + delay, self._timer_count, self.handler))
+        if len(timers) == 0:
+            return None                     # wait for a command
+        return max(0, timers[0][0] - now)
 
     @run_in_thread
     def event_loop(self):
         logger.info("event loop started ...")
         while True:
-            try:
-                self.handler()
-            except Exception as exc:
-                logger.error("Exception: %s", str(exc))
-            time.sleep(self.loop_delay)
+            self.wake_event.clear()
+            timeout = self.next_timeout(self.step())
+            self.clock.wait(self.wake_event, timeout)
+
+    async def event_loop_async(self):
+        "run the state machine as an asyncio task"
+        import asyncio
+
+        logger.info("event loop started ...")
+        self._async_event = asyncio.Event()
+        self._async_loop = asyncio.get_running_loop()
+        while True:
+            self._async_event.clear()
+            timeout = self.next_timeout(self.step())
+            await self.clock.wait_async(self._async_event, timeout)
     
     def idle(self):
         """
         no commanded activity, keep the controller working, look for new commands
         """
-        if len(self.queue) == 0:
-            return                      # nothing to do
+        request = self.queue.get()      # next request in the queue
+        if request is None:
+            return None                 # nothing to do until a command arrives
+        self.dispatched(request)
 
-        t_now = time.time()
-        request = self.queue.pop(0)     # next request in the queue
+        t_now = self.clock.time()
         logger.info(
             "(%s) %s(%d,%d)  (@%s, %s)",
             datetime.datetime.fromtimestamp(t_now).isoformat(sep=" ", timespec="seconds"),
@@ -138,7 +242,11 @@ class StateMachine:
             )
 
         cmd = request.get("command_id")
-        if cmd == "COOL":
+        if cmd in program.COMMANDS and self.program_step_waiting():
+            # a multi-step program: the rest of it is read by do_program()
+            self.load_program([program.from_request(request)])
+
+        elif cmd == "COOL":
             rate = 360.0                    # K/h
             sp = request["arg1"] * 0.01     # K
             temp_now = cs800_status.memory["StatusGasTemp"]
@@ -150,7 +258,7 @@ class StateMachine:
                 self.handler = self.do_cool
 
                 ramp_time_s = (temp_now - sp) / rate*3600
-                self.target_time = time.time() + ramp_time_s
+                self.target_time = self.clock.time() + ramp_time_s
 
         elif cmd == "END":
             rate = 360      # K / h
@@ -164,11 +272,11 @@ class StateMachine:
 
             temp_now = cs800_status.memory["StatusGasTemp"]
             ramp_time_s = abs(sp - temp_now) / rate*3600
-            self.target_time = time.time() + ramp_time_s
+            self.target_time = self.clock.time() + ramp_time_s
 
         elif cmd == "PLAT":
             duration = request["arg1"]          # minutes
-            self.target_time = time.time() + duration*60.0
+            self.target_time = self.clock.time() + duration*60.0
             cs800_status.phase_id = "Plat"
             self.handler = self.do_plat
 
@@ -193,7 +301,7 @@ class StateMachine:
                 self.handler = self.do_ramp
 
                 ramp_time_s = (sp - temp_now) / rate*3600
-                self.target_time = time.time() + ramp_time_s
+                self.target_time = self.clock.time() + ramp_time_s
 
         elif cmd == "PURGE":
             rate = 360      # K / h
@@ -206,19 +314,21 @@ class StateMachine:
 
             temp_now = cs800_status.memory["StatusGasTemp"]
             ramp_time_s = abs(sp - temp_now) / rate*3600
-            self.target_time = time.time() + ramp_time_s
+            self.target_time = self.clock.time() + ramp_time_s
 
         elif cmd == "STOP":
             cs800_status.run_mode = "Shutdown OK"
 
         elif cmd == "RESTART":
             cs800_status.run_mode = "Startup OK"
+
+        return 0                        # next command or the new phase, now
     
     def do_cool(self):
         """
         Make gas temperature decrease to a set value as quickly as possible.
         """
-        time_left = self.target_time - time.time()
+        time_left = self.target_time - self.clock.time()
         sp = cs800_status.memory["StatusTargetTemp"]
         rate = cs800_status.memory["StatusRampRate"]
         temp_now = cs800_status.memory["StatusGasTemp"]
@@ -231,11 +341,12 @@ class StateMachine:
             cs800_status.phase_id = self.idle_phase
             # if len(self.queue) == 0:
             #     self.do_hold()
-            return
+            return 0
 
         sp += time_left * rate / 3600.0
         cs800_status.memory["StatusGasSetPoint"] = sp
         self.set_time_remaining(time_left)
+        return self.ramp_delay(rate, time_left)
 
     def do_end(self):
         """
@@ -255,16 +366,13 @@ class StateMachine:
             self.set_time_remaining(0)
             self.handler = self.idle
             cs800_status.phase_id = self.idle_phase
-            self.queue = [
-                dict(command_id="STOP", arg1=0, arg2=0, time=time.time()),
-                dict(command_id="PLAT", arg1=1, arg2=0, time=time.time()),
-                dict(command_id="RESTART", arg1=0, arg2=0, time=time.time()),
-                ]
-            return
+            self.queue.replace(self.shutdown_sequence())
+            return 0
 
         sp += time_left * rate / 3600.0
         cs800_status.memory["StatusGasSetPoint"] = sp
         self.set_time_remaining(time_left)
+        return self.ramp_delay(rate, time_left)
 
     def do_hold(self):
         """
@@ -276,7 +384,7 @@ class StateMachine:
         logger.info(
             "(%s) HOLD",
             datetime.datetime.fromtimestamp(
-                time.time()
+                self.clock.time()
                 ).isoformat(sep=" ", timespec="seconds"),
             )
 
@@ -284,8 +392,10 @@ class StateMachine:
         cs800_status.memory["StatusRemaining"] = 0
         self.paused = False
         self.phase_id_paused = None
+        self.handler_paused = None
+        self.program = None
         self.target_time = 0.0
-        self.queue = []     # disables any further commands
+        self.queue.replace()    # disables any further commands
         cs800_status.phase_id = "Hold"
         self.handler = self.idle
 
@@ -295,7 +405,7 @@ class StateMachine:
         
         ... until instructed otherwise by a RESUME command. 
         """
-        self.time_paused = time.time()
+        self.time_paused = self.clock.time()
         self.phase_id_paused = cs800_status._phase_id
         logger.info(
             "(%s) PAUSE  %s",
@@ -305,6 +415,8 @@ class StateMachine:
                 str(self.phase_id_paused)
             )
         # remember to keep track of where we were for RESUME
+        self.handler_paused = self.handler
+        self.handler = self.do_wait
         cs800_status.phase_id = "Wait"
         self.paused = True
 
@@ -312,7 +424,7 @@ class StateMachine:
         """
         Maintain the current temperature for a set amount of time.
         """
-        time_left = self.target_time - time.time()
+        time_left = self.target_time - self.clock.time()
         self.set_time_remaining(time_left)
         if time_left < 0:
             cs800_status.memory["StatusRemaining"] = 0
@@ -320,19 +432,51 @@ class StateMachine:
             cs800_status.phase_id = self.idle_phase
             # if len(self.queue) == 0:
             #     self.do_hold()
-            return
+            return 0
+        return self.remaining_delay(time_left)
+
+    def do_program(self):
+        """
+        Follow the compiled set point trajectory of a multi-step program.
+        """
+        while self.program_step_waiting():
+            # more steps have arrived: add them to the end of the program
+            request = self.queue.get()
+            self.dispatched(request)
+            self.program.append(*program.from_request(request))
+
+        state = self.program.at(self.clock.time() - self.program_start)
+        cs800_status.memory["StatusGasSetPoint"] = state.setpoint
+        if state.done:
+            logger.info("program complete")
+            self.set_time_remaining(0)
+            self.handler = self.idle
+            cs800_status.phase_id = self.idle_phase
+            if self.program.shutdown:
+                self.queue.prepend(self.shutdown_sequence())
+            self.program = None
+            return 0
+
+        cs800_status.memory["StatusTargetTemp"] = state.target
+        cs800_status.memory["StatusRampRate"] = state.rate
+        if cs800_status._phase_id != state.phase:
+            cs800_status.phase_id = state.phase
+        self.set_time_remaining(state.remaining)
+        if state.phase == "Plat":
+            return self.remaining_delay(state.remaining)
+        return self.ramp_delay(state.rate, state.remaining)
 
     def do_purge(self):
         """
         Bring the gas temperature and the internal temperature to 300 K then shut down. 
         """
-        self.do_end()   # simulate
+        return self.do_end()   # simulate
     
     def do_ramp(self):
         """
         Change gas temperature to a set value at a controlled rate. 
         """
-        time_left = self.target_time - time.time()
+        time_left = self.target_time - self.clock.time()
         self.set_time_remaining(time_left)
         sp = cs800_status.memory["StatusTargetTemp"]
         rate = cs800_status.memory["StatusRampRate"]
@@ -346,10 +490,11 @@ class StateMachine:
             cs800_status.phase_id = self.idle_phase
             # if len(self.queue) == 0:
             #     self.do_hold()
-            return
+            return 0
 
         sp -= time_left * rate / 3600.0
         cs800_status.memory["StatusGasSetPoint"] = sp
+        return self.ramp_delay(rate, time_left)
     
     def do_resume(self):
         """
@@ -359,38 +504,106 @@ class StateMachine:
         logger.info(
             "(%s) RESUME %s",
             datetime.datetime.fromtimestamp(
-                time.time()
+                self.clock.time()
                 ).isoformat(sep=" ", timespec="seconds"),
                 str(resume_phase_id)
             )
-        self.target_time += time.time() - self.time_paused
+        time_paused = self.clock.time() - self.time_paused
+        self.target_time += time_paused
+        self.program_start += time_paused
         self.time_paused = 0
-        self.handler = self.resumable_handlers[resume_phase_id]
+        self.handler = self.handler_paused or self.resumable_handlers[resume_phase_id]
+        self.handler_paused = None
         self.paused = False
 
         cs800_status.phase_id = resume_phase_id
         self.phase_id_paused = None
     
+    def do_wait(self):
+        """
+        Paused: keep the set point until RESUME (or HOLD).
+        """
+        return None
+
+    def load_program(self, steps):
+        """
+        start a program of `steps` (see ``program.read_program()``) now
+
+        The program starts from the current gas temperature.
+        """
+        self.program = program.Program(cs800_status.memory["StatusGasTemp"], steps)
+        self.program_start = self.clock.time()
+        self.paused = False
+        self.handler = self.do_program
+        logger.info(
+            "program: %d step(s), %.0f s",
+            len(self.program), self.program.duration)
+
+    def program_step_waiting(self):
+        """is the next request in the queue a program step?"""
+        request = self.queue.peek()
+        return request is not None and request.get("command_id") in program.COMMANDS
+
+    def shutdown_sequence(self):
+        """commands that shut down the controller after END or PURGE"""
+        t = self.clock.time()
+        return [
+            dict(command_id="STOP", arg1=0, arg2=0, time=t),
+            dict(command_id="PLAT", arg1=1, arg2=0, time=t),
+            dict(command_id="RESTART", arg1=0, arg2=0, time=t),
+            ]
+
     def set_time_remaining(self, time_left):
         cs800_status.memory["StatusRemaining"] = int(time_left/60 + 0.5)
 
+    def ramp_delay(self, rate, time_left):
+        """
+        time (s) until a ramp at `rate` (K/h) moves the set point by 0.01 K
+
+        0.01 K is the resolution of the status packet.  The wait is no
+        longer than `max_delay` since the end of the ramp also depends
+        on the (simulated) gas temperature.
+        """
+        delay = 0.01 * 3600 / rate if rate > 0 else self.max_delay
+        return max(self.min_delay, min(delay, time_left, self.max_delay))
+
+    def remaining_delay(self, time_left):
+        """time (s) until StatusRemaining (rounded minutes) changes"""
+        delay = (time_left + 30) % 60 or 60.0
+        return max(self.min_delay, min(delay, time_left))
+
 
 @run_in_thread
-def identity():
-    emit_id.announcer()
+def trace_report(period):
+    "log the command latencies every `period` s"
+    while True:
+        time.sleep(period)
+        logger.info("command latency:\n%s", tracing.tracer.report())
+        logger.info("status broadcasts: %s", cs800_status.scheduler)
+
+
+async def trace_report_async(period):
+    "log the command latencies every `period` s, as an asyncio task"
+    import asyncio
+
+    while True:
+        await asyncio.sleep(period)
+        logger.info("command latency:\n%s", tracing.tracer.report())
+        logger.info("status broadcasts: %s", cs800_status.scheduler)
 
 
 @run_in_thread
-def status():
-    global cs800_status
-    cs800_status = broadcast_status.CS800()
-    cs800_status.smoothing = 0.15
-    cs800_status.emit_status()
+def identity(timers=None, interface=None, mac=None, udp_host="<broadcast>"):
+    emit_id.announcer(timers, interface, mac, udp_host)
 
 
-def commands():
+def commands(
+        clock=None, steps=None,
+        queue_size=64, overflow=command_queue.DROP_NEWEST):
     global cs800_commands
-    state_machine = StateMachine()
+    state_machine = StateMachine(clock, queue_size=queue_size, overflow=overflow)
+    if steps:
+        state_machine.addProgram(steps)
     cs800_commands = controller.CS800controller()
     cs800_commands.handler(state_machine.addCommand)
 
@@ -406,31 +619,222 @@ def get_user_parameters():
         dest='cid',
         default=None,
         help="Controller ID (default: random)")
-    return parser.parse_args()
-
-
-def main():
-    global cs800_status
-
-    user_parms = get_user_parameters()
-    
-    identity()
-    status()
-    while cs800_status is None:
-        logger.info("waiting for threads to start ...")
-        time.sleep(1)   # let threads start
+    parser.add_argument(
+        '-r',
+        dest='rate',
+        type=float,
+        default=1.0,
+        help="status broadcast rate, Hz (default: 1)")
+    parser.add_argument(
+        '--overrun',
+        dest='overrun',
+        choices=scheduler.OVERRUN_POLICIES,
+        default=scheduler.SKIP,
+        help="what to do with missed status deadlines (default: skip)")
+    parser.add_argument(
+        '-f',
+        dest='status_format',
+        type=int,
+        default=utils.STATUS_FORMAT_FULL,
+        help="status packet format (default: 0=full, 1=EPICS)")
+    parser.add_argument(
+        '--formats',
+        dest='formats_file',
+        default=None,
+        help="JSON file of user-defined status formats: {number: [parameter, ...]}")
+    parser.add_argument(
+        '--queue-size',
+        dest='queue_size',
+        type=int,
+        default=64,
+        help="most commands waiting to run (default: 64)")
+    parser.add_argument(
+        '--queue-overflow',
+        dest='queue_overflow',
+        choices=command_queue.OVERFLOW_POLICIES,
+        default=command_queue.DROP_NEWEST,
+        help="which command to drop when the queue is full (default: drop-newest)")
+    parser.add_argument(
+        '--program',
+        dest='program_file',
+        default=None,
+        help="temperature program file to run at startup (see program.py)")
+    parser.add_argument(
+        '--trace',
+        dest='trace_period',
+        type=float,
+        default=None,
+        help=(
+            "trace command-to-status latency and status broadcast overruns,"
+            " report every TRACE_PERIOD s"))
+    parser.add_argument(
+        '--interface',
+        dest='interface',
+        default=None,
+        help="announce the MAC address of this network interface (default: of the default route)")
+    parser.add_argument(
+        '--mac',
+        dest='mac',
+        default=None,
+        help="announce this MAC address (default: of the network interface)")
+    parser.add_argument(
+        '--asyncio',
+        dest='use_asyncio',
+        action='store_true',
+        default=False,
+        help="run all ports in one asyncio event loop (default: threads)")
+    parser.add_argument(
+        '--time-scale',
+        dest='time_scale',
+        type=float,
+        default=1.0,
+        help="run the simulation this many times faster than real time (default: 1)")
+    parser.add_argument(
+        '--virtual',
+        action='store_true',
+        default=False,
+        help=(
+            "run the simulation in virtual (discrete-event) time, as fast as possible"
+            f" (ID and status are sent to {VIRTUAL_HOST}, not broadcast)"))
+    parser.add_argument(
+        '--noise-redraw',
+        dest='noise_redraw',
+        type=float,
+        default=broadcast_status.NOISE_REDRAW,
+        help=(
+            "fraction (0 .. 1] of the noisy status values drawn anew each tick;"
+            " less than 1 re-encodes fewer packet slots (default: 1)"))
+    user_parms = parser.parse_args()
+    if not 0 < user_parms.noise_redraw <= 1:
+        parser.error("--noise-redraw must be in the range (0, 1]")
+    return user_parms
+
+
+def get_clock(user_parms):
+    """return the simulation clock selected by the user's parameters"""
+    if user_parms.virtual:
+        # participants: timer scheduler (broadcasts) and state machine event loop
+        return clocks.VirtualClock(participants=2)
+    if user_parms.time_scale != 1:
+        return clocks.ScaledClock(user_parms.time_scale)
+    return clocks.RealClock()
+
+
+def configure(user_parms):
+    """apply the user's parameters to the simulated controller"""
     if user_parms.cid is None:
         cid = cs800_status.memory["SetUpControllerNumber"]
         logger.info("Controller ID: {}".format(cid))
     else:
         cs800_status.memory["SetUpControllerNumber"] = int(user_parms.cid)
         logger.info("Setting controller ID: {}".format(user_parms.cid))
+    if user_parms.formats_file is not None:
+        with open(user_parms.formats_file, "r") as fp:
+            for number, keys in json.load(fp).items():
+                cs800_status.define_status_format(int(number), keys)
+    cs800_status.status_format = user_parms.status_format
+    if user_parms.virtual:
+        # keep the packets of virtual time off the LAN
+        cs800_status.udp_host = VIRTUAL_HOST
+
+
+async def run_async(user_parms, clock):
+    """
+    simulate the controller with all ports as tasks of one asyncio event loop
+    """
+    import asyncio
+
+    import transport     # asyncio: imported only in this mode
+
+    global cs800_status
+
+    cs800_status = broadcast_status.CS800(clock, user_parms.noise_redraw)
+    cs800_status.smoothing = 0.15
+    configure(user_parms)
+    state_machine = StateMachine(
+        clock, start=False,
+        queue_size=user_parms.queue_size, overflow=user_parms.queue_overflow)
+    if user_parms.program_file is not None:
+        state_machine.addProgram(program.read_program(user_parms.program_file))
+
+    errors = controller.ErrorLog()
+
+    def receive_command(data, addr):
+        results = controller.decode_command(data, addr)
+        if "error" in results:
+            errors.error(results["error_kind"], results["error"])
+        else:
+            logger.debug("command: %s", results)
+            tracing.tracer.received(results)
+            state_machine.addCommand(results)
+
+    async def startup():
+        cs800_status.run_mode = "Startup OK"
+        await asyncio.sleep(STARTUP_TIME)
+        cs800_status.run_mode = "Run"
+
+    sender = await transport.open_sender()
+    await transport.open_receiver(
+        controller.COMMAND_PORT, receive_command, controller.COMMAND_HOST)
+    id_message = emit_id.identity_message(
+        *emit_id.get_identity(user_parms.interface, user_parms.mac))
+    id_address = (
+        VIRTUAL_HOST if user_parms.virtual else transport.BROADCAST,
+        emit_id.ID_PORT)
+    status_address = (cs800_status.udp_host, cs800_status.udp_port)
+
+    timers = scheduler.TimerScheduler(clock)
+    timers.add(lambda: sender.sendto(id_message, id_address))
+    cs800_status.scheduler = timers.add(
+        lambda: sender.sendto(cs800_status.next_message(), status_address),
+        user_parms.rate, user_parms.overrun)
     logger.info("Emitting ID & status, waiting for commands...")
-    cs800_status.run_mode = "Startup OK"
-    time.sleep(1)
-    cs800_status.run_mode = "Run"
-    commands()
+    tasks = [
+        timers.run_async(),
+        state_machine.event_loop_async(),
+        startup(),
+    ]
+    if user_parms.trace_period is not None:
+        tasks.append(trace_report_async(user_parms.trace_period))
+    await asyncio.gather(*tasks)
 
 
+def main():
+    global cs800_status
+
+    user_parms = get_user_parameters()
+    clock = get_clock(user_parms)
+    if user_parms.trace_period is not None:
+        tracing.tracer.enabled = True
+    steps = None
+    if user_parms.program_file is not None:
+        steps = program.read_program(user_parms.program_file)
+    if user_parms.use_asyncio:
+        import asyncio
+
+        asyncio.run(run_async(user_parms, clock))
+        return
+
+    # status first: the first packet goes out as soon as the timers start
+    cs800_status = broadcast_status.CS800(clock, user_parms.noise_redraw)
+    cs800_status.smoothing = 0.15
+    configure(user_parms)
+    cs800_status.run_mode = "Startup OK"
+    timers = scheduler.TimerScheduler(clock)
+    cs800_status.emit_status(user_parms.rate, user_parms.overrun, timers)
+    timers.start()
+    identity(
+        timers, user_parms.interface, user_parms.mac,
+        VIRTUAL_HOST if user_parms.virtual else "<broadcast>")
+    if user_parms.trace_period is not None:
+        trace_report(user_parms.trace_period)
+
+    def run():
+        cs800_status.run_mode = "Run"
+
+    threading.Timer(STARTUP_TIME, run).start()
+    logger.info("Emitting ID & status, waiting for commands...")
+    commands(clock, steps, user_parms.queue_size, user_parms.queue_overflow)
+
 if __name__ == "__main__":
     main()
@@ -2,14 +2,32 @@
 
 """
 discover CS800 controllers by their UDP broadcasts
+
+``Registry`` keeps the controllers seen recently, one for each IP address
+and controller number (``SetUpControllerNumber`` in the status broadcasts,
+port 30304): the simulated controllers of ``fleet.py`` share one IP
+address.  The NetBIOS name and MAC address (identity broadcasts, port
+30303) are joined by IP address; where several controllers share an IP
+address, by their synthetic MAC address (``utils.synthetic_mac()``).
+A controller not heard from for `ttl` seconds is removed.
+
+USAGE::
+
+    registry = Registry(on_appeared=print, on_disappeared=print)
+    ...     # call identity_received() and status_received() for each packet
+    ip = registry[3117]     # IP address of controller number 3117
 """
 
+import asyncio
+import collections
+import collections.abc
 import datetime
 import logging
-import socket
 import time
-import uuid
 
+import emit_id
+import status_packet
+import transport
 import utils
 
 
@@ -17,49 +35,250 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
+ID_PACKET_SIZE = 34
+STATUS_PORT = 30304
 
-def discover():
+
+def parse_identity(data):
+    """return (NetBIOS name, MAC address) of identity broadcast `data`, None if invalid"""
+    if len(data) != ID_PACKET_SIZE:
+        return None
+    try:
+        mac_addr = bytes(data[-17:]).decode()
+    except UnicodeDecodeError:
+        return None
+    try:
+        netbios_name = bytes(data[:16]).decode().strip()
+    except UnicodeDecodeError:
+        netbios_name = "<undefined>"     # a CS800 pads it with 0xff
+    return netbios_name, mac_addr
+
+
+class Controller:
+    """what is known about one controller"""
+
+    __slots__ = (
+        "ip", "netbios_name", "mac_addr", "controller_number",
+        "first_seen", "last_seen")
+
+    def __init__(self, ip, controller_number, t):
+        self.ip = ip
+        self.netbios_name = None
+        self.mac_addr = None
+        self.controller_number = controller_number
+        self.first_seen = t
+        self.last_seen = t
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"ip='{self.ip}'"
+            f", netbios_name={self.netbios_name!r}"
+            f", mac_addr={self.mac_addr!r}"
+            f", controller_number={self.controller_number})"
+        )
+
+
+class Registry(collections.abc.Mapping):
     """
-    listen for CS800 identity UDP broadcasts
+    controllers seen in the last `ttl` seconds
+
+    As a mapping: controller number to IP address (as used by
+    ``fleet_commander.FleetCommander``).  ``controllers`` maps
+    (IP address, controller number) to ``Controller``.  A controller
+    appears with its first status broadcast; identity broadcasts only
+    name it.  `on_appeared(controller)` and `on_disappeared(controller)`
+    are called as controllers come and go.  Times are ``time.monotonic()``.
     """
-    udp_port = 30303			        # CS800 ID broadcast port
-    udp_host = ""                       # nothing in particular
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    ttl = 5.0       # s, identity is broadcast every second
 
-    # For linux hosts all sockets that want to share the same address
-    # and port combination must belong to processes that share the same
-    # effective user ID!
+    def __init__(self, ttl=None, on_appeared=None, on_disappeared=None):
+        if ttl is not None:
+            self.ttl = ttl
+        self.on_appeared = on_appeared
+        self.on_disappeared = on_disappeared
+        # least recently seen first, so eviction only looks at the front
+        self.controllers = collections.OrderedDict()    # (ip, controller number): Controller
+        self.identities = collections.OrderedDict()     # (ip, MAC address): (NetBIOS name, t)
+        self.numbers_at = {}                            # ip: {controller number}
+        self.macs_at = {}                               # ip: {MAC address}
+        self.numbers = {}                               # controller number: ip
+        self.macs = {}                                  # MAC address: (ip, controller number)
+        self.decoder = status_packet.StatusProjection(["SetUpControllerNumber"])
 
-    # Enable broadcasting mode
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    def __getitem__(self, number):
+        return self.numbers[number]
 
-    sock.bind((udp_host, udp_port))
-    logger.info("Listening for CS800 ID on port: %d", udp_port)
+    def __iter__(self):
+        return iter(self.numbers)
 
-    while True:
-        data, addr = sock.recvfrom(1024)
-        t = time.time()
-        dt = datetime.datetime.fromtimestamp(t).isoformat(sep=" ", timespec="milliseconds")
-        ip, port = addr
-        if len(data) == 34:
-            try:
-                netbios_name = data[:16].decode().strip()
-            except UnicodeDecodeError:
-                netbios_name = "<undefined>"
-            mac_addr = data[-17:]
-            print(
-                "({},{}:{}) {} {}".format(
-                    dt,
-                    ip,
-                    port,
-                    netbios_name,
-                    mac_addr
-                    )
-                )
+    def __len__(self):
+        return len(self.numbers)
+
+    def by_mac(self, mac_addr):
+        """return the Controller with `mac_addr`, None if not known"""
+        return self.controllers.get(self.macs.get(mac_addr))
+
+    def by_number(self, number):
+        """return the Controller with controller `number`, None if not known"""
+        return self.controllers.get((self.numbers.get(number), number))
+
+    def _forget(self, index, key, value):
+        """remove `key` from `index` if it still points to `value`"""
+        if index.get(key) == value:
+            del index[key]
+
+    def _discard(self, index, ip, item):
+        """remove `item` from the set of `ip` in `index`"""
+        items = index.get(ip)
+        if items is not None:
+            items.discard(item)
+            if len(items) == 0:
+                del index[ip]
+
+    def _identify(self, controller):
+        """set the NetBIOS name and MAC address of `controller` from the identity broadcasts"""
+        ip = controller.ip
+        macs = self.macs_at.get(ip, ())
+        if len(macs) == 1:
+            mac_addr = next(iter(macs))
+        else:
+            # controllers sharing an IP address are simulated
+            synthetic = utils.synthetic_mac(controller.controller_number)
+            mac_addr = next(
+                (m for m in macs if utils.normalize_mac(m) == synthetic), None)
+        key = (ip, controller.controller_number)
+        if controller.mac_addr != mac_addr:
+            self._forget(self.macs, controller.mac_addr, key)
+        controller.mac_addr = mac_addr
+        if mac_addr is None:
+            controller.netbios_name = None
         else:
-            print("({}, {} {}) {}".format(dt, ip, len(data), data))
+            controller.netbios_name = self.identities[(ip, mac_addr)][0]
+            self.macs[mac_addr] = key
+
+    def _notify(self, callback, controller):
+        if callback is not None:
+            try:
+                callback(controller)
+            except Exception as exc:
+                logger.error("Exception: %s", str(exc))
 
+    def identity_received(self, data, addr, t=None):
+        """update the registry from the identity broadcast `data` from `addr`"""
+        identity = parse_identity(data)
+        if identity is None:
+            logger.debug("%s: not an identity broadcast: %s", addr[0], bytes(data))
+            return
+        t = time.monotonic() if t is None else t
+        self.evict(t)
+        ip = addr[0]
+        netbios_name, mac_addr = identity
+        key = (ip, mac_addr)
+        known = self.identities.pop(key, None)
+        self.identities[key] = (netbios_name, t)        # now the most recent
+        if known is None:
+            self.macs_at.setdefault(ip, set()).add(mac_addr)
+            for number in self.numbers_at.get(ip, ()):
+                self._identify(self.controllers[(ip, number)])
+        elif known[0] != netbios_name:
+            controller = self.by_mac(mac_addr)
+            if controller is not None:
+                controller.netbios_name = netbios_name
+
+    def status_received(self, data, addr, t=None):
+        """update the registry from the status broadcast `data` from `addr`"""
+        try:
+            number = self.decoder.decode(data)["SetUpControllerNumber"]
+        except status_packet.PacketError:
+            return
+        if number is None:
+            return      # not in this packet format
+        t = time.monotonic() if t is None else t
+        self.evict(t)
+        ip = addr[0]
+        key = (ip, number)
+        controller = self.controllers.get(key)
+        if controller is not None:
+            controller.last_seen = t
+            self.controllers.move_to_end(key)
+            return
+        controller = self.controllers[key] = Controller(ip, number, t)
+        self.numbers_at.setdefault(ip, set()).add(number)
+        self.numbers[number] = ip
+        self._identify(controller)
+        self._notify(self.on_appeared, controller)
+
+    def evict(self, t=None):
+        """remove the controllers (and identity broadcasts) not seen for `ttl` s"""
+        oldest = (time.monotonic() if t is None else t) - self.ttl
+        controllers = self.controllers
+        while len(controllers) > 0:
+            key, controller = next(iter(controllers.items()))
+            if controller.last_seen >= oldest:
+                break
+            del controllers[key]
+            ip, number = key
+            self._discard(self.numbers_at, ip, number)
+            self._forget(self.numbers, number, ip)
+            self._forget(self.macs, controller.mac_addr, key)
+            self._notify(self.on_disappeared, controller)
+        identities = self.identities
+        while len(identities) > 0:
+            key, (_netbios_name, last_seen) = next(iter(identities.items()))
+            if last_seen >= oldest:
+                break
+            del identities[key]
+            self._discard(self.macs_at, *key)
+
+
+async def run_registry(registry):
+    """keep `registry` up to date from the broadcasts, in an asyncio task"""
+    # batch receivers: a large fleet bursts, and the kernel's drops are logged
+    transport.open_batch_receiver(emit_id.ID_PORT, registry.identity_received)
+    transport.open_batch_receiver(STATUS_PORT, registry.status_received)
+    while True:
+        await asyncio.sleep(registry.ttl / 5)
+        registry.evict()
+
+
+def discover():
+    """
+    report CS800 controllers as they appear and disappear on the LAN
+    """
+    def report(event):
+        def callback(controller):
+            dt = datetime.datetime.now().isoformat(sep=" ", timespec="milliseconds")
+            print(f"({dt}) {event}: {controller}", flush=True)
+        return callback
+
+    registry = Registry(on_appeared=report("appeared"), on_disappeared=report("disappeared"))
+    logger.info("Listening for CS800 ID on port: %d", emit_id.ID_PORT)
+    asyncio.run(run_registry(registry))
+
+
+def report_identity(data, addr, t):
+    """print the identity broadcast `data` received from `addr` at time `t`"""
+    dt = datetime.datetime.fromtimestamp(t).isoformat(sep=" ", timespec="milliseconds")
+    ip, port = addr
+    if len(data) == 34:
+        try:
+            netbios_name = data[:16].decode().strip()
+        except UnicodeDecodeError:
+            netbios_name = "<undefined>"
+        mac_addr = data[-17:]
+        print(
+            "({},{}:{}) {} {}".format(
+                dt,
+                ip,
+                port,
+                netbios_name,
+                mac_addr
+                )
+            )
+    else:
+        print("({}, {} {}) {}".format(dt, ip, len(data), data))
 
 if __name__ == "__main__":
     discover()
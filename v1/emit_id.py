@@ -6,8 +6,8 @@ emit ID message
 
 import logging
 import socket
-import time
 
+import scheduler
 import utils
 
 
@@ -16,9 +16,41 @@ logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
 
-def announcer():
+ID_PORT = 30303          # CS800 ID broadcast port
+
+
+def identity_message(netbios_name, mac_addr):
+    """
+    return the ID broadcast: `netbios_name` and `mac_addr` (12 hex digits)
+    """
+    # MAC address is coded as text 
+    bsmac = "-".join([mac_addr[p:p+2] for p in range(0, len(mac_addr), 2)])
+
+    msg = "{:15s}".format(netbios_name).encode()
+    msg += bytes((0x0d, 0x0a))
+    msg += bsmac.encode()
+    return msg
+
+
+def get_identity(interface=None, mac=None):
+    """
+    return (NetBIOS name, MAC address) of this host
+
+    The MAC address is `mac` if given, else that of `interface`,
+    else that of the interface of the default route.
+    """
+    mac_addr = utils.get_mac(interface, mac)[0]       # MAC as string
+    netbios_name = socket.gethostname().split(".")[0]
+    return netbios_name, mac_addr
+
+
+def announcer(timers=None, interface=None, mac=None, udp_host="<broadcast>"):
     """
     announce our NetBIOS name and MAC address by UDP broadcasts every second
+
+    With `timers` (a ``scheduler.TimerScheduler``), the broadcasts are
+    added to it and this returns at once, otherwise this runs forever.
+    The messages are sent to `udp_host` (default: broadcast).
     
     Broadcast consists of two parts: Netbios name and MAC address.
     The documentation states:
@@ -42,17 +74,9 @@ def announcer():
     In this case, it must be that the controller has no assigned
     Netbios name, thus the series of 0xff bytes.
     """
-    udp_port = 30303			        # CS800 ID broadcast port
-    udp_host = "<broadcast>"            # or "<broadcast>"
-    mac_addr = utils.get_mac()[0]       # MAC as string
-    netbios_name = socket.gethostname().split(".")[0]
-
-    # MAC address is coded as text 
-    bsmac = "-".join([mac_addr[p:p+2] for p in range(0, len(mac_addr), 2)])
-
-    msg = "{:15s}".format(netbios_name).encode()
-    msg += bytes((0x0d, 0x0a))
-    msg += bsmac.encode()
+    udp_port = ID_PORT
+    netbios_name, mac_addr = get_identity(interface, mac)
+    msg = identity_message(netbios_name, mac_addr)
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
 
@@ -69,14 +93,14 @@ def announcer():
 
     logger.info("%s (MAC: %s)", netbios_name, mac_addr)
 
-    t0 = time.time()
+    def send():
+        sock.sendto(msg, (udp_host, udp_port))
+        logger.debug("message sent: %s", msg)
 
-    while True:
-        if time.time() > t0:
-            sock.sendto(msg, (udp_host, udp_port))
-            logger.debug("message sent: %s", msg)
-            t0 += 1
-        time.sleep(0.01)
+    if timers is None:
+        scheduler.DeadlineScheduler(1.0).run(send)
+    else:
+        timers.add(send, 1.0)
 
 
 if __name__ == "__main__":
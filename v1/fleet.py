@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""
+simulate a fleet of CS800 controllers in one process
+
+The status of all controllers is kept in one 2-D array
+(controllers x parameters).  Each tick advances the thermal model
+of every controller with one vectorized step and then broadcasts
+one status packet per controller (each with its own
+``SetUpControllerNumber``) through one shared socket.
+
+Only the status (and, optionally, ID) broadcasts are simulated.
+Commands are given by calling the methods of ``Fleet`` (such as
+``ramp()`` or ``cool()``).
+
+Each controller announces a synthetic MAC address made from its
+controller number (``utils.synthetic_mac()``), so no network
+interface of the host is looked up.
+"""
+
+import argparse
+import functools
+import logging
+import math
+import numpy as np
+import socket
+
+import broadcast_status
+import clocks
+import emit_id
+import id_registry
+import scheduler
+import status_packet
+import utils
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# logger.setLevel(logging.DEBUG)
+
+# phases in which the set point moves toward the target temperature
+MOVING_PHASES = [utils.PHASE_IDS.index(p) for p in "Ramp Cool End".split()]
+HOLD_PHASE = utils.PHASE_IDS.index("Hold")
+
+
+class Fleet:
+    """
+    simulate `count` CS800 controllers, status broadcasts only
+
+    USAGE::
+
+        fleet = Fleet(200)
+        fleet.ramp(range(10), 360, 150)
+        fleet.emit_status()
+    """
+
+    def __init__(
+            self, count, first_controller_number=None, clock=None,
+            noise_redraw=broadcast_status.NOISE_REDRAW):
+        self.clock = clock or clocks.RealClock()
+        self.udp_port = 30304			        # CS800 status broadcast port
+        self.udp_host = "255.255.255.255"        # or "<broadcast>"
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Enable broadcasting mode
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.settimeout(0.2)
+
+        self.encoder = status_packet.StatusEncoder()
+        self.keys = self.encoder.keys
+        self.column = {k: i for i, k in enumerate(self.keys)}
+        self.smoothing = 0.15   # 0 .. 1 : higher is slower to converge
+        self.noise_amplitude = 0.1       # RMS fluctuations, K
+
+        # set some initial values, not typical though
+        initial = np.array(self.encoder.ids, dtype=float)
+        self.state = np.tile(initial, (count, 1))
+        self.set("StatusGasSetPoint", 100.0)
+        self.set("StatusGasTemp", 100.0)
+        self.set("StatusTargetTemp", 100.0)
+        self.set("StatusRunTime", 0.0)
+        self.set("StatusRampRate", 360)
+        self.set("StatusRemaining", 0)
+        self.set("StatusRunMode", utils.RUN_MODES.index("Run"))
+        self.set("StatusPhaseId", HOLD_PHASE)
+        if first_controller_number is None:
+            first_controller_number = broadcast_status.rand(3100, 30)
+        self.set("SetUpControllerNumber", first_controller_number + np.arange(count))
+        self.set("SetUpColdheadNumber", np.random.randint(3220, 3251, count))
+        self.set("SetUpCommissionDate", np.random.randint(3330, 3361, count))
+        self.set("DeviceH8Firmware", np.random.randint(1100, 1131, count))
+        self.start_time = self.clock.time()
+        self.last_step = self.start_time
+
+        # same parameter classes (and redraw fraction) as the single
+        # controller simulator: each tick draws the next `count` columns
+        noisy = [
+            k
+            for k in self.keys
+            if k not in broadcast_status.CS800.constant_parameters
+        ]
+        self.noisy_parameters = []
+        for keys, base, width, integer in (
+                ([k for k in noisy if k in utils.TEMPERATURE_PARAMETERS], 150, 5, False),
+                ([k for k in noisy if k in utils.PERCENT_PARAMETERS], 30, 5, True),
+                (
+                    [
+                        k
+                        for k in noisy
+                        if k not in utils.TEMPERATURE_PARAMETERS
+                        and k not in utils.PERCENT_PARAMETERS
+                    ],
+                    500, 50, True
+                ),
+            ):
+            columns = np.array([self.column[k] for k in keys], dtype=int)
+            count = max(1, math.ceil(len(columns)*noise_redraw))
+            self.noisy_parameters.append((columns, count, base, width, integer))
+        self.ticks = 0
+
+        self.step()
+
+    def __len__(self):
+        return len(self.state)
+
+    def get(self, parm, controllers=slice(None)):
+        """return the values of `parm` for the `controllers` (default: all)"""
+        return self.state[controllers, self.column[parm]]
+
+    def set(self, parm, value, controllers=slice(None)):
+        """set `parm` to `value` for the `controllers` (default: all)"""
+        self.state[controllers, self.column[parm]] = value
+
+    def cool(self, controllers, setpoint):
+        """cool the `controllers` down to T=`setpoint` as quickly as possible"""
+        controllers = self._index(controllers)
+        controllers = controllers[self.get("StatusGasTemp", controllers) > setpoint]
+        self._move(controllers, 360, setpoint, "Cool")
+
+    def end(self, controllers):
+        """bring the gas temperature of the `controllers` to 300 K"""
+        self._move(self._index(controllers), 360, 300, "End")
+
+    def hold(self, controllers):
+        """stay at the current set point indefinitely"""
+        controllers = self._index(controllers)
+        self.set("StatusTargetTemp", self.get("StatusGasSetPoint", controllers), controllers)
+        self.set("StatusRemaining", 0, controllers)
+        self.set("StatusPhaseId", HOLD_PHASE, controllers)
+
+    def ramp(self, controllers, rate, setpoint):
+        """
+        ramp the `controllers` at `rate` (K/h) up to T=`setpoint`
+
+        * rate (K/hour): 1 .. 360, otherwise the command is ignored
+        """
+        if not 1 <= rate <= 360:
+            logger.warning("ramp rate %s K/h is not in 1 .. 360: ignored", rate)
+            return
+        controllers = self._index(controllers)
+        controllers = controllers[self.get("StatusGasTemp", controllers) < setpoint]
+        self._move(controllers, rate, setpoint, "Ramp")
+
+    def _index(self, controllers):
+        return np.arange(len(self))[controllers]
+
+    def _move(self, controllers, rate, target, phase):
+        self.set("StatusRampRate", rate, controllers)
+        self.set("StatusTargetTemp", target, controllers)
+        self.set("StatusPhaseId", utils.PHASE_IDS.index(phase), controllers)
+
+    def step(self):
+        """advance all controllers by the time since the last step"""
+        t_now = self.clock.time()
+        dt = t_now - self.last_step
+        self.last_step = t_now
+        state = self.state     # columns of the full status packet
+
+        # move set points toward their targets
+        moving = np.isin(state[:, id_registry.PHASE_ID], MOVING_PHASES)
+        sp = state[moving, id_registry.GAS_SET_POINT]
+        target = state[moving, id_registry.TARGET_TEMP]
+        rate = state[moving, id_registry.RAMP_RATE]
+        sp += np.clip(target - sp, -rate*dt/3600, rate*dt/3600)
+        state[moving, id_registry.GAS_SET_POINT] = sp
+        state[moving, id_registry.REMAINING] = np.rint(np.abs(target - sp)/rate*60)
+        arrived = np.flatnonzero(moving)[sp == target]
+        state[arrived, id_registry.PHASE_ID] = HOLD_PHASE
+
+        # simulated temperatures
+        n = len(self)
+        sp = np.clip(state[:, id_registry.GAS_SET_POINT], 80, 300)
+        old = np.clip(state[:, id_registry.GAS_TEMP], 80, 300)
+        eta = self.smoothing
+        noise = self.noise_amplitude*np.random.standard_normal(n)
+        state[:, id_registry.GAS_TEMP] = eta*sp + (1 - eta)*old + noise
+        state[:, id_registry.RUN_TIME] = (t_now - self.start_time)/60.0
+        state[:, id_registry.GAS_FLOW] = np.maximum(0, 20 + 5*np.random.standard_normal(n))
+        state[:, id_registry.BACK_PRESSURE] = np.maximum(0, 60 + 5*np.random.standard_normal(n))
+        state[:, id_registry.ALARM_CODE] = np.rint(55*np.random.random(n))
+
+        for columns, count, base, width, integer in self.noisy_parameters:
+            if len(columns) == 0:
+                continue
+            if self.ticks > 0:      # the first step draws all the values
+                start = self.ticks*count
+                columns = columns[np.arange(start, start + count) % len(columns)]
+            values = base + width*np.random.standard_normal((n, len(columns)))
+            if integer:
+                values = np.rint(values)
+            state[:, columns] = values
+        self.ticks += 1
+
+    def create_messages(self):
+        """return the status packets (one row per controller)"""
+        return self.encoder.encode_array(self.state)
+
+    def emit(self):
+        """send the status of every controller through the shared socket"""
+        address = (self.udp_host, self.udp_port)
+        for packet in self.create_messages():
+            self.sock.sendto(packet.tobytes(), address)
+
+    def identity_messages(self):
+        """return the ID broadcast of every controller (synthetic MAC addresses)"""
+        return [
+            emit_id.identity_message(f"CS800-{number}", utils.synthetic_mac(number))
+            for number in self.get("SetUpControllerNumber").astype(int)
+        ]
+
+    def emit_identity(self, timers):
+        """add the ID broadcasts of all controllers (every second) to `timers`"""
+        messages = self.identity_messages()
+        address = (self.udp_host, emit_id.ID_PORT)
+
+        def send():
+            for msg in messages:
+                self.sock.sendto(msg, address)
+
+        return timers.add(send, 1.0)
+
+    def emit_status(self, rate=1.0, overrun=scheduler.SKIP, timers=None, groups=1):
+        """
+        send the status of all controllers at `rate` (Hz, default: 1)
+
+        With `groups` > 1, the controllers are sent in that many groups
+        spread evenly across the period, instead of in one burst.
+
+        With `timers` (a ``scheduler.TimerScheduler``), the broadcasts are
+        added to it and this returns at once, otherwise this runs forever.
+        """
+        own_timers = timers is None
+        if own_timers:
+            timers = scheduler.TimerScheduler(self.clock)
+        address = (self.udp_host, self.udp_port)
+        bounds = np.linspace(0, len(self), groups + 1).astype(int)
+        packets = []
+
+        def send(group):
+            if group == 0:      # the first group advances the whole fleet
+                self.step()
+                packets[:] = self.create_messages()
+            for packet in packets[bounds[group]:bounds[group+1]]:
+                self.sock.sendto(packet.tobytes(), address)
+
+        self.schedulers = [
+            timers.add(functools.partial(send, group), rate, overrun, group / groups)
+            for group in range(groups)
+        ]
+        self.scheduler = self.schedulers[0]
+        if own_timers:
+            timers.run()
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    parser = argparse.ArgumentParser(
+        prog='fleet',
+        description="simulate the status broadcasts of many CS800 controllers")
+    parser.add_argument(
+        '-n',
+        dest='count',
+        type=int,
+        default=200,
+        help="number of controllers (default: 200)")
+    parser.add_argument(
+        '-c',
+        dest='cid',
+        type=int,
+        default=None,
+        help="Controller ID of the first controller (default: random)")
+    parser.add_argument(
+        '-r',
+        dest='rate',
+        type=float,
+        default=1.0,
+        help="status broadcast rate, Hz (default: 1)")
+    parser.add_argument(
+        '--overrun',
+        dest='overrun',
+        choices=scheduler.OVERRUN_POLICIES,
+        default=scheduler.SKIP,
+        help="what to do with missed status deadlines (default: skip)")
+    parser.add_argument(
+        '--stagger',
+        dest='groups',
+        type=int,
+        default=1,
+        help="send the controllers in this many groups across the period (default: 1)")
+    parser.add_argument(
+        '--identity',
+        dest='identity',
+        action='store_true',
+        default=False,
+        help="also broadcast the ID of each controller (synthetic MAC address)")
+    parser.add_argument(
+        '--noise-redraw',
+        dest='noise_redraw',
+        type=float,
+        default=broadcast_status.NOISE_REDRAW,
+        help="fraction (0 .. 1] of the noisy status values drawn anew each tick (default: 1)")
+    user_parms = parser.parse_args()
+    if not 0 < user_parms.noise_redraw <= 1:
+        parser.error("--noise-redraw must be in the range (0, 1]")
+    return user_parms
+
+
+def main():
+    user_parms = get_user_parameters()
+    fleet = Fleet(
+        user_parms.count, user_parms.cid, noise_redraw=user_parms.noise_redraw)
+    logger.info(
+        "Emitting status of %d controllers, IDs %d .. %d",
+        len(fleet),
+        fleet.get("SetUpControllerNumber")[0],
+        fleet.get("SetUpControllerNumber")[-1],
+        )
+    timers = scheduler.TimerScheduler(fleet.clock)
+    if user_parms.identity:
+        fleet.emit_identity(timers)
+    fleet.emit_status(user_parms.rate, user_parms.overrun, timers, user_parms.groups)
+    timers.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+send the same command to many CS800 controllers at once
+
+Targets can be given as:
+
+=============  ==========================================
+target         example
+=============  ==========================================
+IP address     ``"192.168.144.99"``
+CIDR range     ``"192.168.144.0/24"`` (every host address)
+controller ID  ``3117`` (looked up in a `registry`)
+=============  ==========================================
+
+A `registry` is any mapping of controller ID (``SetUpControllerNumber``)
+to IP address, such as the one kept by discovery.
+
+All commands go out through the one socket shared by the commanders of
+this process (``commander.command_socket()``).  Each 7-byte packet is
+computed once per command and sent to every target in turn.
+
+USAGE::
+
+    fleet = FleetCommander(["192.168.144.0/24"])
+    fleet.end(360)
+
+    # in an asyncio task
+    await fleet.send_command_async("end", 360)
+
+    ./fleet_commander.py END 360 -t 192.168.144.0/24
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import logging
+import time
+
+import commander
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_targets(targets, registry=None):
+    """return the list of IP addresses (no duplicates) for `targets`"""
+    addresses = {}      # dict keeps the order
+    for target in targets:
+        if isinstance(target, int):
+            if registry is None or target not in registry:
+                logger.warning("controller %d: not known", target)
+                continue
+            addresses[registry[target]] = None
+        elif "/" in target:
+            network = ipaddress.ip_network(target, strict=False)
+            for host in network.hosts():
+                addresses[str(host)] = None
+        else:
+            addresses[target] = None
+    return list(addresses)
+
+
+class FleetCommander(commander.CS800controller):
+    """
+    send commands to every controller in `targets`
+
+    All the command methods of ``commander.CS800controller``
+    (``ramp()``, ``end()``, ...) send to the whole fleet.
+    """
+
+    def __init__(self, targets, registry=None, port=commander.COMMAND_PORT):
+        self.sock = commander.command_socket()
+        self.hosts = resolve_targets(targets, registry)
+        self.addresses = [(host, port) for host in self.hosts]
+        self.host = None
+        self.sent = 0       # packets sent
+
+        logger.info("Send commands to %d controller(s) on port %d", len(self.hosts), port)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def send_command(self, command, arg1=0, arg2=0):
+        """
+        send CS800 command via UDP to every controller of the fleet
+        """
+        msg = commander.command_packet(command, arg1, arg2)
+        logger.debug("sending %s(%d,%d) to %d controllers", command, arg1, arg2, len(self))
+        self.sent += commander.send_packet(msg, self.addresses, self.sock)
+
+    async def send_command_async(self, command, arg1=0, arg2=0):
+        """
+        send CS800 command via UDP to every controller, in an asyncio task
+
+        The event loop is not blocked when the socket buffer is full.
+        """
+        loop = asyncio.get_running_loop()
+        msg = commander.command_packet(command, arg1, arg2)
+        for address in self.addresses:
+            try:
+                self.sock.sendto(msg, address)
+            except BlockingIOError:
+                await loop.sock_sendto(self.sock, msg, address)
+            except OSError as exc:
+                logger.warning("%s: %s", address[0], exc)
+                continue
+            self.sent += 1
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    parser = argparse.ArgumentParser(
+        prog='fleet_commander',
+        description="send one command to many CS800 controllers")
+    parser.add_argument(
+        'command',
+        help="command name, such as END or RAMP")
+    parser.add_argument(
+        'args',
+        nargs='*',
+        type=int,
+        help="command arguments, as sent (e.g. RAMP: K/h, centiK)")
+    parser.add_argument(
+        '-t',
+        dest='targets',
+        nargs='+',
+        required=True,
+        help="IP addresses or CIDR ranges of the controllers")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    user_parms = get_user_parameters()
+    fleet = FleetCommander(user_parms.targets)
+    t0 = time.perf_counter()
+    fleet.send_command(user_parms.command, *user_parms.args)
+    logger.info(
+        "sent %s to %d controllers in %.3f ms",
+        user_parms.command.upper(), fleet.sent, (time.perf_counter() - t0)*1e3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+dense tables of the status parameter and command IDs
+
+Parameter IDs (``status_ids.json``) and command IDs
+(``utils.COMMAND_IDS``) are 16-bit numbers.  Lists indexed by the
+ID number replace dicts keyed by 2-byte ``bytes``:
+
+==============  ========================================================
+table           for each 16-bit ID number
+==============  ========================================================
+ID_COLUMN       column of the parameter in the full status packet (-1: none)
+ID_NAME         parameter name (None: not a parameter ID)
+ID_SCALE        packet value to engineering units (0.01: centiK to K)
+ID_CLASS        TEMPERATURE, PERCENT, or OTHER
+COMMAND_NAME    command name (None: not a command ID)
+==============  ========================================================
+
+and lists indexed by column (the order of ``status_ids.json``, which is
+the order of the full status packet): ``NAMES``, ``IDS``, ``SCALES``,
+``CLASSES``.  ``ID`` and ``COLUMN`` map a parameter name to its ID
+and column.
+
+The columns of the parameters used by the tools are constants,
+such as ``GAS_TEMP``.  In the full status packet, the value of
+column ``c`` is the 16-bit word at byte offset ``6 + 4*c``.
+
+The parameter tables are built (and ``status_ids.json`` is read) when
+one of them is first used, not at import: the command decoder and the
+command senders need only ``COMMAND_NAME``.  Once built, the tables
+are plain module attributes.
+
+USAGE::
+
+    pid = codec.unpack_u16(data, 4)
+    name, scale = id_registry.ID_NAME[pid], id_registry.ID_SCALE[pid]
+"""
+
+import array
+import functools
+
+import codec
+import utils
+
+OTHER = 0
+TEMPERATURE = 1     # K, sent in centiK
+PERCENT = 2
+CLASS_NAMES = ("other", "temperature", "percent")
+
+ID_COUNT = codec.UINT16_MAX + 1     # every 16-bit ID number
+
+
+def parameter_class(name):
+    """return the class of parameter `name`: TEMPERATURE, PERCENT, or OTHER"""
+    if name in utils.TEMPERATURE_PARAMETERS:
+        return TEMPERATURE
+    if name in utils.PERCENT_PARAMETERS:
+        return PERCENT
+    return OTHER
+
+
+COMMAND_NAME = [None] * ID_COUNT
+for _name, _number in utils.COMMAND_IDS.items():
+    COMMAND_NAME[codec.unpack_u16(_number)] = _name
+
+
+PARAMETER_TABLES = (
+    "NAMES", "IDS", "CLASSES", "SCALES",
+    "ID", "COLUMN",
+    "ID_COLUMN", "ID_NAME", "ID_SCALE", "ID_CLASS",
+    "CONTROLLER_NUMBER", "GAS_SET_POINT", "GAS_TEMP", "TARGET_TEMP",
+    "RUN_MODE", "PHASE_ID", "ALARM_CODE", "RAMP_RATE", "REMAINING",
+    "RUN_TIME", "GAS_FLOW", "BACK_PRESSURE",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def parameter_tables():
+    """build the parameter tables (once), return them as a dict"""
+    names = list(utils.STATUS_IDS)
+    ids = [utils.bs2i(utils.STATUS_IDS[k]) for k in names]
+    classes = [parameter_class(k) for k in names]
+    scales = [0.01 if c == TEMPERATURE else 1 for c in classes]
+
+    id_column = array.array("h", [-1]) * ID_COUNT
+    id_name = [None] * ID_COUNT
+    id_scale = [1] * ID_COUNT
+    id_class = array.array("b", [OTHER]) * ID_COUNT
+    for column, pid in enumerate(ids):
+        id_column[pid] = column
+        id_name[pid] = names[column]
+        id_scale[pid] = scales[column]
+        id_class[pid] = classes[column]
+
+    column = {k: c for c, k in enumerate(names)}
+    tables = dict(
+        NAMES=names,                # by column
+        IDS=ids,
+        CLASSES=classes,
+        SCALES=scales,
+        ID=dict(zip(names, ids)),   # by name
+        COLUMN=column,
+        ID_COLUMN=id_column,        # by ID number
+        ID_NAME=id_name,
+        ID_SCALE=id_scale,
+        ID_CLASS=id_class,
+        # columns of the parameters used by the tools
+        CONTROLLER_NUMBER=column["SetUpControllerNumber"],
+        GAS_SET_POINT=column["StatusGasSetPoint"],
+        GAS_TEMP=column["StatusGasTemp"],
+        TARGET_TEMP=column["StatusTargetTemp"],
+        RUN_MODE=column["StatusRunMode"],
+        PHASE_ID=column["StatusPhaseId"],
+        ALARM_CODE=column["StatusAlarmCode"],
+        RAMP_RATE=column["StatusRampRate"],
+        REMAINING=column["StatusRemaining"],
+        RUN_TIME=column["StatusRunTime"],
+        GAS_FLOW=column["StatusGasFlow"],
+        BACK_PRESSURE=column["FlowBlockBackPressure"],
+    )
+    globals().update(tables)        # no __getattr__() from now on
+    return tables
+
+
+def __getattr__(name):
+    """build the parameter tables when one is first used"""
+    if name in PARAMETER_TABLES:
+        return parameter_tables()[name]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def name(pid):
+    """return the name of parameter ID `pid` (``unknown_<pid>`` if unknown)"""
+    found = parameter_tables()["ID_NAME"][pid]
+    return f"unknown_{pid}" if found is None else found
+
+
+if __name__ == "__main__":
+    parameter_tables()
+    for _column, _name in enumerate(NAMES):
+        print(
+            f"{_column:4d} {IDS[_column]:5d}"
+            f" {_name:32s} {CLASS_NAMES[CLASSES[_column]]}")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+listen for identity and status broadcasts of CS800 controllers
+
+Both ports are received by one asyncio event loop.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+import discover
+import emit_id
+import status_listener
+import transport
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# logger.setLevel(logging.DEBUG)
+
+
+def get_user_parameters():
+    """configure user's command line parameters from sys.argv"""
+    parser = argparse.ArgumentParser(
+        prog='monitor',
+        description="listen to ID and status broadcasts from CS800 controllers on the LAN")
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        default=False,
+        help="full status report (default: terse)")
+    return parser.parse_args()
+
+
+async def monitor(full=False):
+    """
+    print the identity and status broadcasts as they are received
+    """
+    def identity(data, addr):
+        discover.report_identity(data, addr, time.time())
+        sys.stdout.flush()
+
+    def status(data, addr):
+        status_listener.report_status(
+            status_listener.decode_status(data, addr, time.time(), full), full)
+        sys.stdout.flush()
+
+    await transport.open_receiver(emit_id.ID_PORT, identity)
+    await transport.open_receiver(status_listener.STATUS_PORT, status)
+    await asyncio.Event().wait()    # forever
+
+
+def main():
+    user_parms = get_user_parameters()
+    asyncio.run(monitor(user_parms.full))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+temperature programs: a sequence of RAMP, COOL, PLAT, END and PURGE steps
+
+A program is compiled into a piecewise-linear set point trajectory
+(breakpoint times and set points).  The phase, set point and time
+remaining at any time are found by bisection of the breakpoint times,
+without stepping through the program.
+
+Program files have one step per line (temperatures in K, rates in K/h)::
+
+    # comment
+    RAMP 360 150      # rate target
+    PLAT 10           # minutes
+    COOL 100          # target, at 360 K/h
+    END               # to 300 K at 360 K/h
+"""
+
+import bisect
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = "RAMP COOL PLAT END PURGE".split()
+FASTEST_RATE = 360.0    # K/h, COOL, END and PURGE
+END_TEMPERATURE = 300.0     # K
+
+ProgramState = collections.namedtuple(
+    "ProgramState",
+    "phase setpoint target rate remaining done")
+
+
+def from_request(request):
+    """return the program step of a command `request` (as from the command port)"""
+    cmd = request["command_id"]
+    if cmd == "RAMP":
+        return cmd, request["arg1"], request["arg2"] * 0.01, 0
+    elif cmd == "COOL":
+        return cmd, FASTEST_RATE, request["arg1"] * 0.01, 0
+    elif cmd == "PLAT":
+        return cmd, 0, None, request["arg1"]
+    elif cmd in ("END", "PURGE"):
+        return cmd, FASTEST_RATE, END_TEMPERATURE, 0
+    raise ValueError(f"'{cmd}' is not a program step")
+
+
+def read_program(path):
+    """return the list of program steps in the file `path`"""
+    steps = []
+    with open(path, "r") as fp:
+        for line_number, line in enumerate(fp, start=1):
+            words = line.split("#")[0].split()
+            if len(words) == 0:
+                continue
+            cmd, args = words[0].upper(), [float(w) for w in words[1:]]
+            if cmd == "RAMP" and len(args) == 2:
+                steps.append((cmd, args[0], args[1], 0))
+            elif cmd == "COOL" and len(args) == 1:
+                steps.append((cmd, FASTEST_RATE, args[0], 0))
+            elif cmd == "PLAT" and len(args) == 1:
+                steps.append((cmd, 0, None, args[0]))
+            elif cmd in ("END", "PURGE") and len(args) == 0:
+                steps.append((cmd, FASTEST_RATE, END_TEMPERATURE, 0))
+            else:
+                raise ValueError(f"{path} line {line_number}: cannot understand: {line.strip()}")
+    return steps
+
+
+class Program:
+    """
+    piecewise-linear set point trajectory, starting at `temperature` (K)
+
+    Times are in seconds from the start of the program.
+
+    USAGE::
+
+        prog = Program(100, read_program("profile.txt"))
+        state = prog.at(t)      # state.phase, state.setpoint, ...
+    """
+
+    def __init__(self, temperature, steps=()):
+        self.times = [0.0]              # breakpoints
+        self.setpoints = [temperature]  # set point at each breakpoint
+        self.phases = []                # phase of each segment
+        self.rates = []                 # K/h, of each segment
+        self.slopes = []                # K/s, of each segment
+        self.shutdown = False           # END or PURGE: shut down at the end
+        for step in steps:
+            self.append(*step)
+
+    def __len__(self):
+        return len(self.phases)
+
+    @property
+    def duration(self):
+        return self.times[-1]
+
+    def append(self, command, rate=0, target=None, minutes=0):
+        """
+        add a step at the end of the program
+
+        As on the controller, a RAMP only goes up and a COOL only goes down,
+        otherwise the step is ignored.
+        """
+        sp = self.setpoints[-1]
+        self.shutdown = command in ("END", "PURGE")
+        if command == "PLAT":
+            target = sp
+            duration = minutes * 60.0
+        elif (
+                (command == "RAMP" and target <= sp)
+                or (command == "COOL" and target >= sp)
+                or rate <= 0
+        ):
+            logger.info("program step ignored: %s %s %s", command, rate, target)
+            return
+        else:
+            duration = abs(target - sp) / rate * 3600
+        if duration <= 0:
+            return
+
+        self.phases.append(command.capitalize())
+        self.rates.append(rate)
+        self.slopes.append((target - sp) / duration)
+        self.times.append(self.times[-1] + duration)
+        self.setpoints.append(target)
+
+    def at(self, t):
+        """return the ProgramState at `t` s after the start of the program"""
+        if t >= self.times[-1] or len(self.phases) == 0:
+            return ProgramState(None, self.setpoints[-1], self.setpoints[-1], 0, 0, True)
+        i = max(0, bisect.bisect_right(self.times, t) - 1)
+        return ProgramState(
+            self.phases[i],
+            self.setpoints[i] + self.slopes[i] * (t - self.times[i]),
+            self.setpoints[i+1],
+            self.rates[i],
+            self.times[i+1] - t,
+            False,
+            )
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+receive UDP broadcasts in batches, without blocking between datagrams
+
+A burst of broadcasts from many controllers can overflow the kernel's
+socket buffer if each datagram is decoded (and printed) before the next
+one is read.  The receiver here enlarges the socket buffer, waits for
+the socket to become readable, then drains every datagram that is ready
+into a preallocated pool of buffers and hands the whole batch over.
+
+On Linux, the kernel's count of datagrams dropped for lack of buffer
+space is reported with each datagram (``SO_RXQ_OVFL``) and kept
+in ``dropped``.
+"""
+
+import logging
+import selectors
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)     # Linux
+RCVBUF_SIZE = 4 * 1024 * 1024
+PACKET_SIZE = 1024
+POOL_SIZE = 256
+
+
+class BatchReceiver:
+    """
+    receive UDP datagrams on `port` in batches
+
+    USAGE::
+
+        receiver = BatchReceiver(30304)
+        while True:
+            for data, addr in receiver.receive():
+                ...     # data is a memoryview, valid until the next receive()
+    """
+
+    def __init__(
+            self, port, host="",
+            rcvbuf=RCVBUF_SIZE, pool_size=POOL_SIZE, packet_size=PACKET_SIZE):
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Enable broadcasting mode
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            self.drops_reported = True
+        except OSError:
+            self.drops_reported = False
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+        self.pool = [memoryview(bytearray(packet_size)) for _ in range(pool_size)]
+        self.ancbufsize = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+
+        self.received = 0       # datagrams received
+        self.batches = 0        # non-empty batches received
+        self.dropped = 0        # datagrams dropped by the kernel
+        self.time = None        # when the last batch was received
+
+        logger.info(
+            "Receiving on port %d, buffer %d bytes, drops %sreported",
+            port, self.rcvbuf, "" if self.drops_reported else "not ")
+
+    def _recv_into(self, buffer):
+        if self.ancbufsize == 0:
+            return self.sock.recvfrom_into(buffer)
+        nbytes, ancdata, flags, addr = self.sock.recvmsg_into([buffer], self.ancbufsize)
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                dropped = struct.unpack("I", data[:4])[0]
+                if dropped != self.dropped:
+                    logger.warning(
+                        "port %d: kernel dropped %d datagram(s)",
+                        self.port, dropped - self.dropped)
+                    self.dropped = dropped
+        return nbytes, addr
+
+    def receive(self, timeout=None):
+        """
+        wait up to `timeout` s (forever if None), then drain all ready datagrams
+
+        Returns a list of (data, addr) where data is a memoryview into the
+        buffer pool.  The data is only valid until the next call.
+        """
+        batch = []
+        if not self.selector.select(timeout):
+            return batch
+        self.time = time.time()
+        for buffer in self.pool:
+            try:
+                nbytes, addr = self._recv_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            batch.append((buffer[:nbytes], addr))
+        if len(batch) > 0:
+            self.received += len(batch)
+            self.batches += 1
+        return batch
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+run a function periodically against monotonic deadlines
+
+The deadlines are fixed on a grid (start + k*period) so the period does
+not drift by the time spent in the function.  When the function takes
+longer than the period (an overrun), the policy decides what to do with
+the deadlines that have already passed:
+
+==========  ===========================================================
+policy      what happens after an overrun
+==========  ===========================================================
+skip        drop the missed deadlines, wait for the next one on the grid
+catch-up    call the function once for every missed deadline, without waiting
+coalesce    call the function once, now, for all the missed deadlines
+==========  ===========================================================
+
+Overruns and missed deadlines are counted and logged (INFO) at most
+once every ``REPORT_INTERVAL`` seconds.
+
+``TimerScheduler`` runs many periodic functions (every emitter of every
+simulated controller in the process) from one heap of deadlines, in one
+thread or asyncio task.  It wakes only when a function is due.  The
+functions with the same period are spread across the period (phase
+staggering), so many controllers do not all broadcast at the same instant.
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import threading
+
+import clocks
+
+logger = logging.getLogger(__name__)
+
+SKIP = "skip"
+CATCH_UP = "catch-up"
+COALESCE = "coalesce"
+OVERRUN_POLICIES = (SKIP, CATCH_UP, COALESCE)
+
+MIN_RATE = 0.1      # Hz
+MAX_RATE = 1000.0   # Hz
+GOLDEN_RATIO = (math.sqrt(5) - 1) / 2   # spreads phases evenly, one at a time
+REPORT_INTERVAL = 10.0  # s, between reports of overruns
+
+
+class DeadlineScheduler:
+    """
+    call a function at `rate` (Hz) with an explicit `overrun` policy
+
+    The deadlines are measured with `clock` (default: ``clocks.RealClock()``).
+
+    USAGE::
+
+        scheduler = DeadlineScheduler(rate=10, overrun="skip")
+        scheduler.run(send_status)
+    """
+
+    def __init__(self, rate=1.0, overrun=SKIP, clock=None):
+        if not MIN_RATE <= rate <= MAX_RATE:
+            raise ValueError(
+                f"rate must be {MIN_RATE} .. {MAX_RATE} Hz, received {rate}")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(
+                f"overrun must be one of {OVERRUN_POLICIES}, received '{overrun}'")
+        self.clock = clock or clocks.RealClock()
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.overrun = overrun
+
+        self.ticks = 0          # number of calls
+        self.overruns = 0       # number of deadlines that had passed already
+        self.missed = 0         # number of deadlines dropped without a call
+        self.max_late = 0.0     # longest time a call was late, s
+        self.deadline = None
+        self.cancelled = False  # removed from its TimerScheduler
+        self._reported = 0      # overruns already reported
+        self._report_time = None
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"rate={self.rate}"
+            f", overrun='{self.overrun}'"
+            f", ticks={self.ticks}"
+            f", overruns={self.overruns}"
+            f", missed={self.missed}"
+            f", max_late={self.max_late:.6f})"
+        )
+
+    def next_deadline(self, now):
+        """
+        advance to the next deadline after a call that ended at `now`
+
+        Returns the time to wait (s) before the next call.
+        """
+        self.deadline += self.period
+        late = now - self.deadline
+        if late <= 0:
+            return -late                    # on time
+
+        # overrun: the deadline has passed already
+        self.overruns += 1
+        self.max_late = max(self.max_late, late)
+        passed = math.floor(late / self.period)    # later deadlines also passed
+        if self.overrun == SKIP:
+            self.missed += passed + 1
+            self.deadline += (passed + 1) * self.period
+            wait = self.deadline - now
+        elif self.overrun == COALESCE:
+            self.missed += passed
+            self.deadline += passed * self.period
+            wait = 0
+        else:   # CATCH_UP
+            wait = 0
+        logger.debug(
+            "overrun: %.6f s late, %d missed deadline(s) so far",
+            late, self.missed)
+        self.report(now)
+        return wait
+
+    def report(self, now):
+        """log the overruns since the last report, at most every REPORT_INTERVAL s"""
+        if self.overruns == self._reported:
+            return
+        if self._report_time is not None and now - self._report_time < REPORT_INTERVAL:
+            return
+        logger.info(
+            "%g Hz: %d overrun(s), %d missed deadline(s) in all, up to %.6f s late",
+            self.rate, self.overruns - self._reported, self.missed, self.max_late)
+        self._reported = self.overruns
+        self._report_time = now
+
+    def run(self, func, count=None):
+        """
+        call `func()` at the scheduled rate
+
+        Runs forever unless `count` calls have been made.
+        """
+        self.deadline = self.clock.monotonic()
+        while count is None or count > 0:
+            func()
+            self.ticks += 1
+            if count is not None:
+                count -= 1
+            wait = self.next_deadline(self.clock.monotonic())
+            if wait > 0:
+                self.clock.sleep(wait)
+
+
+class TimerScheduler:
+    """
+    call many functions, each at its own rate, from one heap of deadlines
+
+    Each function added has its own ``DeadlineScheduler`` (rate, overrun
+    policy and counters).  Unless a `phase` (fraction of the period) is
+    given, the k-th function with a given period starts at phase
+    ``k * 0.618... mod 1``, which keeps the start times evenly spread
+    however many functions are added.
+
+    USAGE::
+
+        timers = TimerScheduler()
+        timers.add(send_identity, rate=1)
+        timers.add(send_status, rate=1)
+        timers.run()            # or: await timers.run_async()
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock or clocks.RealClock()
+        self.heap = []              # (deadline, count, DeadlineScheduler, func)
+        self._count = itertools.count()
+        self._phases = {}           # period: number of functions added
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self._async_event = None
+        self._async_loop = None
+        self.wakeups = 0            # times the scheduler woke up
+
+    def __len__(self):
+        return len(self.heap)
+
+    def add(self, func, rate=1.0, overrun=SKIP, phase=None):
+        """
+        call `func()` at `rate` (Hz), return its ``DeadlineScheduler``
+
+        `phase` (0 .. 1) delays the first call by that fraction of the period.
+        """
+        sched = DeadlineScheduler(rate, overrun, self.clock)
+        if phase is None:
+            k = self._phases.get(sched.period, 0)
+            self._phases[sched.period] = k + 1
+            phase = (k * GOLDEN_RATIO) % 1.0
+        sched.deadline = self.clock.monotonic() + phase * sched.period
+        with self.lock:
+            heapq.heappush(self.heap, (sched.deadline, next(self._count), sched, func))
+        self.wake()
+        return sched
+
+    def remove(self, sched):
+        """stop calling the function of `sched` (from ``add()``)"""
+        with self.lock:
+            sched.cancelled = True      # not pushed back if it is being called
+            self.heap = [entry for entry in self.heap if entry[2] is not sched]
+            heapq.heapify(self.heap)
+
+    def wake(self):
+        "look at the deadlines again now"
+        self.wake_event.set()
+        if self._async_loop is not None:
+            self._async_loop.call_soon_threadsafe(self._async_event.set)
+
+    def run_due(self):
+        """
+        call every function that is due, return the time (s) until the next one
+
+        Returns None if there are no functions.
+        """
+        while True:
+            now = self.clock.monotonic()
+            with self.lock:
+                if len(self.heap) == 0:
+                    return None
+                deadline, _count, sched, func = self.heap[0]
+                if deadline > now:
+                    return deadline - now
+                heapq.heappop(self.heap)
+                if sched.cancelled:
+                    continue
+            try:
+                func()
+            except Exception as exc:
+                logger.error("Exception: %s", str(exc))
+            sched.ticks += 1
+            now = self.clock.monotonic()
+            wait = sched.next_deadline(now)
+            with self.lock:
+                if not sched.cancelled:
+                    heapq.heappush(self.heap, (now + wait, next(self._count), sched, func))
+
+    def run(self):
+        """call the functions when due, forever"""
+        while True:
+            self.wake_event.clear()
+            timeout = self.run_due()
+            self.wakeups += 1
+            self.clock.wait(self.wake_event, timeout)
+
+    def start(self):
+        """run the scheduler in a thread"""
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    async def run_async(self):
+        """call the functions when due, forever, in an asyncio task"""
+        import asyncio
+
+        self._async_event = asyncio.Event()
+        self._async_loop = asyncio.get_running_loop()
+        while True:
+            self._async_event.clear()
+            timeout = self.run_due()
+            self.wakeups += 1
+            await self.clock.wait_async(self._async_event, timeout)
@@ -8,11 +8,12 @@ import argparse
 import datetime
 import logging
 import pprint
-import socket
 import sys
 import time
 
-import utils
+import codec
+import receiver
+import status_packet
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -20,12 +21,29 @@ logger = logging.getLogger(__name__)
 
 STATUS_PORT = 30304
 STATUS_HOST = ""
-REVERSE_IDS = {v:k for k, v in utils.STATUS_IDS.items()}
+TERSE_PARAMETERS = (
+    "SetUpControllerNumber",
+    "StatusRunMode",
+    "StatusPhaseId",
+    "StatusGasSetPoint",
+    "StatusGasTemp",
+)
+decoder = status_packet.StatusDecoder()
+terse_decoder = status_packet.StatusProjection(TERSE_PARAMETERS)
 
 
 def get_status(sock):
+    """receive and decode one status packet from `sock`"""
     data, addr = sock.recvfrom(1024)
-    t = time.time()
+    return decode_status(data, addr, time.time())
+
+
+def decode_status(data, addr, t, full=True):
+    """
+    decode status packet `data` received from `addr` at time `t`
+
+    With ``full=False``, only the TERSE_PARAMETERS are decoded.
+    """
     dt = datetime.datetime.fromtimestamp(t)
     iso = dt.isoformat(sep=" ", timespec="milliseconds")
     ip, port = addr
@@ -39,18 +57,14 @@ def get_status(sock):
     # * FOOTER _BYTE1, FOOTER _BYTE2 – unique 16-bit footer 
 
     # The HEADER is defined as 0xAAAB and the FOOTER is defined as 0xABAA.
-    data_size = utils.bs2i(data[2:4])
-
-    # TODO: confirm the checksum or report CHECKSUM_ERROR
+    data_size = codec.unpack_u16(data, 2) if len(data) >= 4 else 0
 
-    base = 4
-    status = {}
-    for offset in range(0, data_size, 4):
-        parm = REVERSE_IDS[data[base+offset:base+offset+2]]
-        value = utils.bs2i(data[base+2+offset:base+2+offset+2])
-        if parm in utils.TEMPERATURE_PARAMETERS:
-            value = value/100.0     # T communicated in centiKelvin
-        status[parm] = value
+    try:
+        status = (decoder if full else terse_decoder).decode(data)
+        error = None
+    except status_packet.PacketError as exc:
+        status = {}
+        error = str(exc)
 
     return dict(
         time=t,
@@ -60,6 +74,7 @@ def get_status(sock):
         # data=data,
         data_size=data_size,
         status=status,
+        error=error,
     )
 
 
@@ -73,6 +88,12 @@ def get_user_parameters():
         type=bool,
         default=False,
         help="full report (default: terse)")
+    parser.add_argument(
+        '--no-checksum',
+        dest='verify_checksum',
+        action='store_false',
+        default=True,
+        help="terse report: do not verify the checksum, decode only the 5 values")
     return parser.parse_args()
 
 
@@ -81,31 +102,39 @@ def listen_for_status():
     listen for the UDP status broadcasts of the CS800 controller(s)
     """
     user_parms = get_user_parameters()
+    # the checksum is a sum over the whole packet, not just the 5 values
+    terse_decoder.verify_checksum = user_parms.verify_checksum
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    # Enable broadcasting mode
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.bind((STATUS_HOST, STATUS_PORT))
+    listener = receiver.BatchReceiver(STATUS_PORT, STATUS_HOST)
 
     logger.info("Status updates from '%s' on port %d", STATUS_HOST, STATUS_PORT)
 
     while True:
-        status = get_status(sock)
-        if user_parms.full:
-            pprint.pprint(status)
-        else:
-            # terse report
-            print(
-                f"({status['datetime']}"
-                f",{status['ip']}"
-                f",#{status['status']['SetUpControllerNumber']})"
-                f" mode={status['status']['StatusRunMode']}"
-                f" phase={status['status']['StatusPhaseId']}"
-                f" SP={status['status']['StatusGasSetPoint']}"
-                f" T={status['status']['StatusGasTemp']}"
-            )
+        # drain everything that is ready before decoding and printing
+        for data, addr in listener.receive():
+            report_status(
+                decode_status(data, addr, listener.time, user_parms.full),
+                user_parms.full)
         sys.stdout.flush()
 
 
+def report_status(status, full=False):
+    """print the (decoded) `status`"""
+    if status["error"] is not None:
+        logger.warning("(%s,%s) %s", status["datetime"], status["ip"], status["error"])
+    elif full:
+        pprint.pprint(status)
+    else:
+        # terse report
+        print(
+            f"({status['datetime']}"
+            f",{status['ip']}"
+            f",#{status['status']['SetUpControllerNumber']})"
+            f" mode={status['status']['StatusRunMode']}"
+            f" phase={status['status']['StatusPhaseId']}"
+            f" SP={status['status']['StatusGasSetPoint']}"
+            f" T={status['status']['StatusGasTemp']}"
+        )
+
 if __name__ == "__main__":
     listen_for_status()
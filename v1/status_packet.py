@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+
+"""
+precompiled layout of the CS800 status packet
+
+The data section of a UDP status packets has the following structure:
+
+HEADER_BYTE1, HEADER_BYTE2, DATA_SIZE_BYTE1, DATA_SIZE_BYTE2, ID_BYTE1, ID_BYTE2,
+VALUE_BYTE1, VALUE_BYTE2, ..., CHECKSUM_BYTE1, CHECKSUM_BYTE2, FOOTER_BYTE1,
+FOOTER_BYTE2
+
+The parameter IDs, the data size, the header and the footer
+do not change from one packet to the next, so the layout is built
+once and only the values (and the checksum) are written on each tick.
+A received packet is validated and decoded in one vectorized pass
+over its 16-bit words.  Consumers that need only a few parameters
+use a ``StatusProjection``, which reads only their words.
+
+NumPy is imported only by the parts that need it (full decoding and
+``encode_array()``), not by the simulator's own encoder.
+"""
+
+import contextlib
+import logging
+import struct
+import threading
+import types
+
+import codec
+import id_registry
+
+logger = logging.getLogger(__name__)
+
+HEADER = 0xaaab
+FOOTER = 0xabaa
+UINT16_MAX = codec.UINT16_MAX
+VALUE = codec.UINT16
+
+# re-encode only the changed slots when no more than this fraction changed
+INCREMENTAL_LIMIT = 0.25
+
+
+class PacketError(ValueError):
+    """status packet is not valid (header, size, checksum, or footer)"""
+
+
+def byte_sum(word):
+    """sum of the two bytes of the 16-bit `word`"""
+    return (word >> 8) + (word & 0xff)
+
+
+class StatusSnapshot:
+    """
+    immutable, consistent copy of the status values
+
+    * ``version`` increases with every commit
+    * ``values`` read-only mapping of the status values
+    * ``changes`` ((version, parameters), ...) of the most recent commits
+    """
+
+    __slots__ = ("version", "values", "changes")
+
+    def __init__(self, version, values, changes):
+        self.version = version
+        self.values = values
+        self.changes = changes
+
+    def changed_since(self, version):
+        """
+        return the set of parameters changed after `version`
+
+        Returns None (everything may have changed) if `version` is
+        None or older than the recorded changes.
+        """
+        if version is None or version < self.changes[0][0] - 1:
+            return None
+        changed = set()
+        for v, parameters in self.changes:
+            if v > version:
+                changed.update(parameters)
+        return changed
+
+
+class StatusMemory(dict):
+    """
+    status values (a dict) that publishes consistent snapshots
+
+    Writers change the values in a ``transaction()`` (a single
+    assignment outside of a transaction is a transaction of its own).
+    When the outermost transaction ends, the new values are published as
+    an immutable ``StatusSnapshot``; a transaction that changed no value
+    publishes nothing.  Readers call ``snapshot()``,
+    which takes no lock, and never see a partial update.
+
+    USAGE::
+
+        with memory.transaction():
+            memory["StatusRampRate"] = rate
+            memory["StatusTargetTemp"] = sp
+        msg = encoder.encode_snapshot(memory.snapshot())
+    """
+
+    history = 32    # number of commits remembered in each snapshot
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()       # serializes the writers only
+        self.version = 0
+        self.changed = set(self.keys())
+        self._depth = 0
+        self._snapshot = None
+        self.commit()
+
+    def __setitem__(self, key, value):
+        with self.transaction():
+            if key not in self or self[key] != value:
+                super().__setitem__(key, value)
+                self.changed.add(key)
+
+    def update(self, *args, **kwargs):
+        values = dict(*args, **kwargs)
+        with self.transaction():
+            for key, value in values.items():
+                self[key] = value
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """group changes, publish them together when the outermost one ends"""
+        with self.lock:
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.commit()
+
+    def commit(self):
+        """publish the current values as a new snapshot, if any changed"""
+        with self.lock:
+            if self._snapshot is not None and len(self.changed) == 0:
+                return
+            self.version += 1
+            changes = ((self.version, frozenset(self.changed)),)
+            if self._snapshot is not None:
+                changes = self._snapshot.changes[1-self.history:] + changes
+            # replacing the reference is atomic: readers need no lock
+            self._snapshot = StatusSnapshot(
+                self.version, types.MappingProxyType(dict(self)), changes)
+            self.changed = set()
+
+    def snapshot(self):
+        """return the most recently published StatusSnapshot"""
+        return self._snapshot
+
+
+class StatusEncoder:
+    """
+    encode the status packet for a fixed list of parameters
+
+    USAGE::
+
+        encoder = StatusEncoder()           # all parameters in status_ids.json
+        msg = encoder.encode(cs800.memory)
+
+    When the parameters that changed since the last packet are given
+    (see ``encode_snapshot()``), only their slots are rewritten and the
+    checksum is corrected by the difference.
+    """
+
+    def __init__(self, keys=None):
+        if keys is None:
+            keys = id_registry.NAMES
+        self.keys = list(keys)
+        self.ids = [id_registry.ID[k] for k in self.keys]
+        self.temperature_index = [
+            i
+            for i, pid in enumerate(self.ids)
+            if id_registry.ID_CLASS[pid] == id_registry.TEMPERATURE
+        ]
+        self.data_size = 4*len(self.keys)
+
+        n = len(self.keys)
+        self.struct = struct.Struct(">HH" + "HH"*n + "HH")
+        self.buffer = bytearray(self.struct.size)
+
+        # ID/value pairs: the IDs are fixed, values are filled in per tick
+        self._pairs = [0] * (2*n)
+        self._pairs[0::2] = self.ids
+        self._data = memoryview(self.buffer)[4:4+self.data_size]
+
+        # cache of the packet in self.buffer, for incremental re-encoding
+        self._slot = {k: i for i, k in enumerate(self.keys)}
+        self._temperature_keys = set(self.keys[i] for i in self.temperature_index)
+        self._checksum = 0
+        self._valid = False
+        self.version = None     # of the last encoded snapshot
+
+    def __len__(self):
+        return self.struct.size
+
+    def values(self, memory):
+        """return the 16-bit integer values to be reported from `memory`"""
+        values = [memory[k] for k in self.keys]
+        for i in self.temperature_index:
+            values[i] = values[i]*100 + 0.5     # report T in centiKelvin
+        # out of range values would not fit in the 16-bit field
+        return [min(max(int(v), 0), UINT16_MAX) for v in values]
+
+    def invalidate(self):
+        """the next ``encode()`` must rewrite the whole packet"""
+        self._valid = False
+
+    def encode_snapshot(self, snapshot):
+        """
+        return the status packet (bytes) for the StatusSnapshot `snapshot`
+
+        Only the parameters changed since the previously encoded
+        snapshot are re-encoded.
+        """
+        changed = snapshot.changed_since(self.version) if self._valid else None
+        msg = self.encode(snapshot.values, changed)
+        self.version = snapshot.version
+        return msg
+
+    def encode(self, memory, changed=None):
+        """
+        return the status packet (bytes) for the values in `memory`
+
+        Only the parameters in `changed` are re-encoded, if given.
+        """
+        if changed is not None:
+            changed = [k for k in changed if k in self._slot]  # in this format
+        if (
+                not self._valid
+                or changed is None
+                or len(changed) > INCREMENTAL_LIMIT*len(self.keys)
+        ):
+            self._pairs[1::2] = self.values(memory)
+            self.struct.pack_into(
+                self.buffer, 0,
+                HEADER, self.data_size, *self._pairs, 0, FOOTER)
+            # 16-bit checksum: simple sum of all the bytes of the ids and values
+            self._checksum = sum(self._data)
+            self._valid = True
+        else:
+            self._update(memory, changed)
+        VALUE.pack_into(
+            self.buffer, 4+self.data_size, self._checksum & UINT16_MAX)
+        return bytes(self.buffer)
+
+    def _update(self, memory, changed):
+        """rewrite the slots of the `changed` parameters, correct the checksum"""
+        pairs = self._pairs
+        for key in changed:
+            i = self._slot.get(key)
+            if i is None:
+                continue    # not reported in this packet format
+            value = memory[key]
+            if key in self._temperature_keys:
+                value = value*100 + 0.5     # report T in centiKelvin
+            value = min(max(int(value), 0), UINT16_MAX)
+            old = pairs[2*i + 1]
+            if value != old:
+                pairs[2*i + 1] = value
+                VALUE.pack_into(self.buffer, 6 + 4*i, value)
+                self._checksum += byte_sum(value) - byte_sum(old)
+
+    def encode_array(self, values):
+        """
+        encode one status packet per row of the 2-D array `values`
+
+        The columns of `values` are in the order of ``self.keys``, in
+        engineering units (as in ``memory``).  Returns a 2-D array of
+        big-endian 16-bit words, one packet per row: use ``.tobytes()``
+        on a row to get the packet to send.
+        """
+        import numpy as np
+
+        values = np.array(values, dtype=float, ndmin=2)
+        values[:, self.temperature_index] = (
+            values[:, self.temperature_index]*100 + 0.5)    # centiKelvin
+        values = np.clip(np.trunc(values), 0, UINT16_MAX).astype(">u2")
+
+        rows, n = values.shape
+        packets = np.empty((rows, 2*n + 4), dtype=">u2")
+        packets[:, 0] = HEADER
+        packets[:, 1] = self.data_size
+        packets[:, 2:-2:2] = self.ids
+        packets[:, 3:-2:2] = values
+        packets[:, -1] = FOOTER
+        # 16-bit checksum: simple sum of all the bytes of the ids and values
+        words = packets[:, 2:-2].astype(np.int64)
+        packets[:, -2] = ((words >> 8) + (words & 0xff)).sum(axis=1) & UINT16_MAX
+        return packets
+
+
+class PacketLayout:
+    """names and scaling of one sequence of parameter IDs"""
+
+    def __init__(self, ids, names):
+        import numpy as np
+
+        self.ids = ids
+        self.names = names
+        id_list = ids.tolist()
+        self.temperature_index = [
+            i
+            for i, pid in enumerate(id_list)
+            if id_registry.ID_CLASS[pid] == id_registry.TEMPERATURE
+        ]
+        self.scale = np.array([id_registry.ID_SCALE[pid] for pid in id_list], dtype=float)
+        self.dtype = np.dtype([(k, float) for k in names])
+
+
+class StatusDecoder:
+    """
+    validate and decode received status packets
+
+    USAGE::
+
+        decoder = StatusDecoder()
+        status = decoder.decode(data)           # dict
+        record = decoder.decode_record(data)    # numpy record
+
+    The layout (parameter names and temperature columns) of each
+    distinct sequence of parameter IDs is computed once and cached.
+    """
+
+    def __init__(self):
+        self.layouts = {}
+
+    def words(self, data):
+        """
+        return the (ids, values) arrays of the status packet `data`
+
+        Raises ``PacketError`` if the packet is not valid.
+        """
+        import numpy as np
+
+        size = len(data)
+        if size < 8 or size % 4 != 0:
+            raise PacketError(f"status packet wrong length {size}")
+        words = np.frombuffer(data, dtype=">u2")
+        if words[0] != HEADER or words[-1] != FOOTER:
+            raise PacketError(
+                f"status packet header/footer {words[0]:#06x}/{words[-1]:#06x}")
+        data_size = int(words[1])
+        if data_size != size - 8:
+            raise PacketError(
+                f"status packet data size {data_size}, received {size - 8}")
+        cksum = int(np.frombuffer(data, dtype=np.uint8, count=data_size, offset=4).sum())
+        if cksum & UINT16_MAX != words[-2]:
+            raise PacketError("status packet checksum error")
+        return words[2:-2:2], words[3:-2:2]
+
+    def layout(self, ids):
+        """return the (cached) PacketLayout for the array of `ids`"""
+        key = ids.tobytes()
+        layout = self.layouts.get(key)
+        if layout is None:
+            names = [id_registry.name(pid) for pid in ids.tolist()]
+            layout = PacketLayout(ids.copy(), names)
+            self.layouts[key] = layout
+        return layout
+
+    def decode(self, data):
+        """return dict of the parameter values in status packet `data`"""
+        ids, values = self.words(data)
+        layout = self.layout(ids)
+        values = values.tolist()
+        for i in layout.temperature_index:
+            values[i] = values[i]/100.0     # T communicated in centiKelvin
+        return dict(zip(layout.names, values))
+
+    def decode_record(self, data):
+        """return numpy record of the parameter values in status packet `data`"""
+        ids, values = self.words(data)
+        layout = self.layout(ids)
+        return (values*layout.scale).view(layout.dtype)[0]
+
+
+def check_packet(data):
+    """
+    raise ``PacketError`` if the status packet `data` is not valid
+
+    Same checks as ``StatusDecoder.words()``, without NumPy.
+    """
+    size = len(data)
+    if size < 8 or size % 4 != 0:
+        raise PacketError(f"status packet wrong length {size}")
+    header = codec.unpack_u16(data, 0)
+    footer = codec.unpack_u16(data, size - 2)
+    if header != HEADER or footer != FOOTER:
+        raise PacketError(f"status packet header/footer {header:#06x}/{footer:#06x}")
+    data_size = codec.unpack_u16(data, 2)
+    if data_size != size - 8:
+        raise PacketError(
+            f"status packet data size {data_size}, received {size - 8}")
+    if codec.checksum16(data[4:4+data_size]) != codec.unpack_u16(data, size - 4):
+        raise PacketError("status packet checksum error")
+
+
+class ProjectionLayout:
+    """offsets of the projected parameters in one sequence of parameter IDs"""
+
+    def __init__(self, size, ids, names):
+        self.size = size
+        self.fields = []        # (name, offset of the value, is temperature)
+        self.checks = []        # (offset of the ID, ID)
+        self.missing = []       # names not in this layout
+        column = {pid: c for c, pid in enumerate(ids)}
+        for name in names:
+            pid = id_registry.ID.get(name)
+            c = column.get(pid)
+            if c is None:
+                self.missing.append(name)
+                continue
+            self.fields.append(
+                (name, 6 + 4*c, id_registry.ID_CLASS[pid] == id_registry.TEMPERATURE))
+            self.checks.append((4 + 4*c, pid))
+
+    def matches(self, data):
+        """do the projected parameters of `data` have the offsets of this layout?"""
+        if len(data) != self.size:
+            return False
+        for offset, pid in self.checks:
+            if codec.unpack_u16(data, offset) != pid:
+                return False
+        return True
+
+    def read(self, data):
+        """return dict of the projected parameter values in `data`"""
+        status = dict.fromkeys(self.missing)
+        for name, offset, temperature in self.fields:
+            value = codec.unpack_u16(data, offset)
+            status[name] = value/100.0 if temperature else value
+        return status
+
+
+class StatusProjection:
+    """
+    decode only the parameters `names` of received status packets
+
+    USAGE::
+
+        projection = StatusProjection(["SetUpControllerNumber", "StatusGasTemp"])
+        status = projection.decode(data)    # dict of these 2 parameters
+
+    A packet is decoded by reading the (few) words of the projected
+    parameters at precomputed offsets, when its length and the IDs at
+    these offsets match the layout of the previous packet.  Otherwise
+    the layout has changed: the full sequence of parameter IDs is read
+    and looked up to find (or build) its layout.  A projected parameter
+    that is not in the packet is None.
+
+    The checksum is a sum over the whole packet: with the default
+    ``verify_checksum=True`` a decode still costs O(packet), although
+    only the projected words are converted.  With
+    ``verify_checksum=False``, only the header, size, and footer are
+    checked and a decode costs O(number of names).
+    """
+
+    def __init__(self, names, verify_checksum=True):
+        self.names = list(names)
+        unknown = [k for k in self.names if k not in id_registry.ID]
+        if len(unknown) > 0:
+            raise KeyError(f"unknown status parameter(s): {unknown}")
+        self.verify_checksum = verify_checksum
+        self.layouts = {}       # tuple of the parameter IDs: ProjectionLayout
+        self.layout = None      # of the previous packet
+        self.layout_changes = 0
+
+    def check(self, data):
+        """raise ``PacketError`` if the status packet `data` is not valid"""
+        if self.verify_checksum:
+            check_packet(data)
+            return
+        size = len(data)
+        if (
+                size < 8
+                or codec.unpack_u16(data, 0) != HEADER
+                or codec.unpack_u16(data, size - 2) != FOOTER
+                or codec.unpack_u16(data, 2) != size - 8
+        ):
+            raise PacketError(f"status packet not valid, length {size}")
+
+    def find_layout(self, data):
+        """return the (cached) ProjectionLayout of the packet `data`"""
+        ids = codec.unpack_u16_array(data, 4, (len(data) - 8) // 2)[0::2]
+        layout = self.layouts.get(ids)
+        if layout is None:
+            layout = ProjectionLayout(len(data), ids, self.names)
+            self.layouts[ids] = layout
+        self.layout_changes += 1
+        return layout
+
+    def decode(self, data):
+        """return dict of the projected parameter values in status packet `data`"""
+        self.check(data)
+        layout = self.layout
+        if layout is None or not layout.matches(data):
+            layout = self.layout = self.find_layout(data)
+        return layout.read(data)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+trace the latency from a command datagram to its effect on the status
+
+Each command (the dict from ``controller.decode_command()``) gets a
+correlation ID (``trace_id``) and a time stamp (``time.monotonic()``,
+not the simulation clock) at each stage:
+
+=========  ================================================================
+stage      when
+=========  ================================================================
+received   the datagram was read from the command port
+queued     the state machine received the command
+dispatched the state machine acted on the command
+published  the first status packet built after the command took effect
+=========  ================================================================
+
+The latencies of each command type are kept in histograms
+(bounded memory) and summarized (p50, p99, max) by ``report()``:
+
+=========  ==================================================
+latency    from .. to
+=========  ==================================================
+ingest     received .. queued
+queue      queued .. dispatched
+publish    dispatched .. published (mostly the status period)
+total      received .. published
+=========  ==================================================
+
+USAGE::
+
+    tracing.tracer.enabled = True
+    ...
+    print(tracing.tracer.report())
+"""
+
+import collections
+import itertools
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCIES = dict(
+    ingest=("t_received", "t_queued"),
+    queue=("t_queued", "t_dispatched"),
+    publish=("t_dispatched", "t_published"),
+    total=("t_received", "t_published"),
+)
+MAX_PENDING = 1024      # dispatched commands waiting for a status packet
+
+
+class LatencyHistogram:
+    """
+    histogram of latencies with logarithmic bins (`per_decade` per decade)
+
+    Percentiles are reported as the upper edge of the bin.
+    """
+
+    minimum = 1e-6      # s, upper edge of the first bin
+    decades = 8         # up to 100 s
+    per_decade = 10
+
+    def __init__(self):
+        self.counts = [0] * (self.decades * self.per_decade + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def _bin(self, seconds):
+        if seconds <= self.minimum:
+            return 0
+        i = math.ceil(math.log10(seconds / self.minimum) * self.per_decade)
+        return min(i, len(self.counts) - 1)
+
+    def _edge(self, i):
+        return self.minimum * 10 ** (i / self.per_decade)
+
+    def add(self, seconds):
+        self.counts[self._bin(seconds)] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """latency (s) below which `p` % of the samples are found"""
+        if self.count == 0:
+            return None
+        needed = self.count * p / 100.0
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if total >= needed:
+                return min(self._edge(i), self.max)
+        return self.max
+
+
+class Tracer:
+    """time stamp commands at each stage, keep latency histograms"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = collections.deque(maxlen=MAX_PENDING)   # (version, request)
+        self.histograms = collections.defaultdict(LatencyHistogram)    # (command, latency)
+
+    def received(self, request, t=None):
+        """stamp a new command with its correlation ID and receive time"""
+        if self.enabled:
+            request["trace_id"] = next(self._ids)
+            request["t_received"] = time.monotonic() if t is None else t
+
+    def queued(self, request):
+        if self.enabled and "trace_id" in request:
+            request["t_queued"] = time.monotonic()
+
+    def dispatched(self, request, version):
+        """
+        the command has been acted on: its effect is in status `version`
+        """
+        if self.enabled and "trace_id" in request:
+            request["t_dispatched"] = time.monotonic()
+            with self.lock:
+                self._pending.append((version, request))
+
+    def published(self, version):
+        """a status packet of `version` has been built for broadcast"""
+        if not self.enabled or len(self._pending) == 0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            pending = self._pending
+            while len(pending) > 0 and pending[0][0] <= version:
+                _version, request = pending.popleft()
+                request["t_published"] = now
+                self._record(request)
+
+    def _record(self, request):
+        cmd = request.get("command_id")
+        for latency, (start, end) in LATENCIES.items():
+            if start in request and end in request:
+                self.histograms[(cmd, latency)].add(request[end] - request[start])
+        logger.debug(
+            "trace %d %s: %.6f s",
+            request["trace_id"], cmd,
+            request["t_published"] - request.get("t_received", request["t_dispatched"]))
+
+    def report(self):
+        """return a table of latencies (ms) by command type"""
+        lines = [
+            f"{'command':16s} {'latency':8s} {'count':>8s}"
+            f" {'p50 ms':>10s} {'p99 ms':>10s} {'max ms':>10s}"
+        ]
+        with self.lock:
+            for (cmd, latency), hist in sorted(self.histograms.items()):
+                lines.append(
+                    f"{cmd:16s} {latency:8s} {hist.count:8d}"
+                    f" {hist.percentile(50)*1e3:10.3f}"
+                    f" {hist.percentile(99)*1e3:10.3f}"
+                    f" {hist.max*1e3:10.3f}"
+                )
+        return "\n".join(lines)
+
+
+tracer = Tracer()
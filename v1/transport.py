@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+asyncio UDP endpoints for the CS800 ports
+
+Each endpoint is a ``DatagramProtocol`` on the running event loop,
+so one thread can send and receive on all ports:
+
+=====  =========  =======================
+port   direction  communication
+=====  =========  =======================
+30303  broadcast  identification
+30304  broadcast  status
+30305  directed   commands
+=====  =========  =======================
+"""
+
+import asyncio
+import logging
+
+import receiver
+
+logger = logging.getLogger(__name__)
+
+BROADCAST = "255.255.255.255"
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    """call `callback(data, addr)` for every datagram received"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        try:
+            self.callback(data, addr)
+        except Exception as exc:
+            logger.error("Exception: %s", str(exc))
+
+    def error_received(self, exc):
+        logger.error("UDP error: %s", str(exc))
+
+
+async def open_receiver(port, callback, host=""):
+    """receive datagrams on `port`, calling `callback(data, addr)` for each"""
+    loop = asyncio.get_running_loop()
+    transport, _protocol = await loop.create_datagram_endpoint(
+        lambda: DatagramHandler(callback),
+        local_addr=(host or "0.0.0.0", port),
+        allow_broadcast=True)
+    logger.info("Receiving on port %d", port)
+    return transport
+
+
+def open_batch_receiver(port, callback, host=""):
+    """
+    receive datagrams on `port` in batches, calling `callback(data, addr)` for each
+
+    Unlike ``open_receiver()``, the socket is a ``receiver.BatchReceiver``
+    (enlarged buffer, kernel drops counted and logged), read whenever the
+    running event loop sees it readable.  `data` is a memoryview, valid
+    only during the callback.  Returns the ``BatchReceiver``.
+    """
+    batch_receiver = receiver.BatchReceiver(port, host)
+
+    def ready():
+        for data, addr in batch_receiver.receive(0):
+            try:
+                callback(data, addr)
+            except Exception as exc:
+                logger.error("Exception: %s", str(exc))
+
+    asyncio.get_running_loop().add_reader(batch_receiver.sock, ready)
+    return batch_receiver
+
+
+async def open_sender():
+    """return a transport for sending (and broadcasting) datagrams"""
+    loop = asyncio.get_running_loop()
+    transport, _protocol = await loop.create_datagram_endpoint(
+        asyncio.DatagramProtocol,
+        local_addr=("0.0.0.0", 0),
+        allow_broadcast=True)
+    return transport
+
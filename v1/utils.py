@@ -2,13 +2,19 @@
 
 """
 utilities
+
+``STATUS_IDS`` is read from ``status_ids.json`` once, when first used.
+``psutil`` is imported only to find the MAC address.
 """
 
 import collections
+import functools
 import json
 import os
-import psutil
-import socket
+import time
+import uuid
+
+import codec
 
 
 TEMPERATURE_PARAMETERS = """
@@ -114,6 +120,9 @@ COMMAND_IDS = dict(
 TURBO_OFF = 0
 TURBO_ON = 1
 
+STATUS_FORMAT_FULL = 0      # all parameters in status_ids.json
+STATUS_FORMAT_EPICS = 1     # only EPICS_PARAMETERS
+
 RUN_MODES = [
     "Startup",
     "Startup Fail",
@@ -142,9 +151,11 @@ PHASE_IDS = [
 def checksum(byte_list, basis=1):
     """
     compute checksum modulo `basis` bytes
+
+    see also: ``codec.checksum8()`` and ``codec.checksum16()``
     """
     limit = 2**(8*basis)
-    return sum([c for c in byte_list]) % limit
+    return sum(byte_list) % limit
 
 
 def getActiveIPconnections():
@@ -154,6 +165,8 @@ def getActiveIPconnections():
     * exclude any local network interfaces
     * return list sorted by greatest number of established connections
     """
+    import psutil
+
     ip_dict = collections.defaultdict(int)
     for conn in psutil.net_connections():
         ip = conn.laddr.ip
@@ -172,6 +185,8 @@ def getActiveNetworkInterfaces():
     """
     return list of the active network interfaces, excluding local or loopback
     """
+    import psutil
+
     active_ip_connections = getActiveIPconnections()
 
     interfaces = psutil.net_if_addrs()
@@ -183,45 +198,104 @@ def getActiveNetworkInterfaces():
     return list(active_interfaces.keys())
 
 
-def get_mac():
+MAC_CACHE_TTL = 60.0    # s
+_mac_cache = {}         # interface (None: any): (time, [MAC, ...])
+
+
+def normalize_mac(text):
+    """return MAC address `text` as 12 lower-case hex digits, None if not a MAC"""
+    mac = "".join(c for c in text.lower() if c in "0123456789abcdef")
+    return mac if len(mac) == 12 else None
+
+
+def synthetic_mac(number):
+    """
+    return a MAC address (12 hex digits) for simulated controller `number`
+
+    The address is locally administered (02:...), so it cannot
+    collide with the address of a real network interface.
     """
-    return a list of the active MAC addresses, sorted by most connections first
+    return "02c5%08x" % (number & 0xffffffff)
+
+
+def default_route_interface():
+    """return the name of the interface of the default route, None if unknown"""
+    try:
+        with open("/proc/net/route", "r") as fp:     # Linux
+            next(fp)        # column titles
+            for line in fp:
+                fields = line.split()
+                if fields[1] == "00000000" and int(fields[3], 16) & 1:   # RTF_UP
+                    return fields[0]
+    except (OSError, StopIteration, IndexError, ValueError):
+        pass
+    return None
+
+
+def interface_macs():
+    """return {interface: MAC address} of the interfaces with a MAC address"""
+    import psutil
+
+    macs = {}
+    for name, addresses in psutil.net_if_addrs().items():
+        for address in addresses:
+            if address.family == psutil.AF_LINK:
+                mac = normalize_mac(address.address)
+                if mac is not None and mac != "000000000000":
+                    macs[name] = mac
+    return macs
+
 
-    see also: https://stackoverflow.com/a/41076835/1046449
+def get_mac(interface=None, mac=None):
     """
-    excluded_inet_connection_families = [
-        socket.AddressFamily.AF_INET,
-        socket.AddressFamily.AF_INET6,
-        ]
-    hexadecimal_characters = "0123456789abcdef"
+    return a list of MAC addresses (12 hex digits), the most likely first
 
-    interfaces = psutil.net_if_addrs()
-    macs = []
-    for nic in getActiveNetworkInterfaces():
-        for conn in interfaces[nic]:
-            # find the MAC address by excluding the other connections
-            if conn.family not in excluded_inet_connection_families:
-                mac = "".join([
-                    c
-                    for c in conn.address
-                    if c.lower() in hexadecimal_characters])
-                if len(mac) == 12:
-                    macs.append(mac)
+    * an explicit `mac` is returned as given
+    * the MAC address of `interface` (ValueError if it has none)
+    * otherwise, the interface of the default route comes first,
+      then the other interfaces
 
-    return macs
+    The list is never empty: without any interface MAC address (or
+    without psutil), it has the address from ``uuid.getnode()``.
+    The interfaces are looked up at most once every MAC_CACHE_TTL seconds.
+    """
+    if mac is not None:
+        normalized = normalize_mac(mac)
+        if normalized is None:
+            raise ValueError(f"not a MAC address: '{mac}'")
+        return [normalized]
+
+    cached = _mac_cache.get(interface)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < MAC_CACHE_TTL:
+        return list(cached[1])
+
+    try:
+        macs = interface_macs()
+    except ImportError:
+        macs = {}
+    if interface is not None:
+        if interface not in macs:
+            raise ValueError(f"interface '{interface}' has no MAC address")
+        first = interface
+    else:
+        first = default_route_interface()
+    ordered = [macs[first]] if first in macs else []
+    ordered += [m for k, m in sorted(macs.items()) if k != first and m not in ordered]
+    if len(ordered) == 0:
+        ordered = ["%012x" % uuid.getnode()]
+
+    _mac_cache[interface] = (now, ordered)
+    return list(ordered)
 
 
 def i2bs(i):
     """
-    convert integer to byte string
+    convert (non-negative) integer to byte string, as few bytes as needed
 
-    inverse of bs2i()
+    inverse of bs2i(), see ``codec.pack_u16()`` for fixed-size fields
     """
-    bs = []
-    while i > 0:
-        bs.append(i % 256)
-        i = i // 256
-    return bytes(reversed(bs))
+    return i.to_bytes(max(1, (i.bit_length() + 7) // 8), "big")
 
 
 def bs2i(bs):
@@ -230,14 +304,12 @@ def bs2i(bs):
 
     inverse of i2bs()
     """
-    i = 0
-    for b in bs:
-        i = i*256 + b
-    return i
+    return int.from_bytes(bs, "big")
 
 
+@functools.lru_cache(maxsize=None)
 def getStatusIds():
-    "return a dictionary of status ID symbols and ID codes"
+    "return a dictionary of status ID symbols and ID codes (read once per process)"
     path = os.path.dirname(__file__)
     with open(os.path.join(path, "status_ids.json"), "r") as fp:
         status_ids = json.load(fp)
@@ -248,16 +320,19 @@ def getStatusIds():
 
 
 def encode2bytes(n):
-    """encode `n` as byte string with length 2"""
-    if n > 255:
-        return i2bs(n)
-    else:
-        return bytes((0, n))
+    """encode `n` as byte string with length 2 (ValueError if out of range)"""
+    return codec.pack_u16(n)
 
 
-STATUS_IDS = getStatusIds()
 COMMAND_IDS = {k: encode2bytes(v) for k, v in COMMAND_IDS.items()}
 
 
+def __getattr__(name):
+    """read STATUS_IDS when it is first used"""
+    if name == "STATUS_IDS":
+        return getStatusIds()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
 if __name__ == "__main__":
     print(get_mac())